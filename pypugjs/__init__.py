@@ -1,4 +1,7 @@
 from __future__ import absolute_import  # noqa
+
+__version__ = '4.2.2'
+
 from .parser import Parser  # noqa
 from .compiler import Compiler  # noqa
 from .utils import process  # noqa
@@ -0,0 +1,222 @@
+from __future__ import absolute_import
+import errno
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+import six
+from six.moves import cPickle as pickle
+
+from . import __version__
+
+
+def replace(src, dst):
+    """Atomically move ``src`` over ``dst``."""
+    if hasattr(os, 'replace'):
+        os.replace(src, dst)
+    elif os.name == 'nt' and os.path.exists(dst):
+        os.remove(dst)
+        os.rename(src, dst)
+    else:
+        os.rename(src, dst)
+
+
+def source_hash(*parts):
+    """Hex digest of ``parts``, text is hashed as utf8."""
+    digest = hashlib.sha1()
+    for part in parts:
+        if not isinstance(part, six.binary_type):
+            part = six.text_type(part).encode('utf8')
+        digest.update(part)
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def class_name(cls):
+    return '%s.%s' % (cls.__module__, cls.__name__)
+
+
+def options_key(options, ignore=()):
+    return repr(sorted((name, repr(value)) for name, value in six.iteritems(options) if name not in ignore))
+
+
+def process_key(src, parser, compiler, options, filename=None):
+    """Cache key of ``pypugjs.utils.process(src, filename, parser=parser,
+    compiler=compiler, **options)``."""
+    return source_hash(__version__, class_name(parser), class_name(compiler), options_key(options), filename or '',
+                       src)
+
+
+class MemoryCache(object):
+    """Least recently used cache holding up to ``maxsize`` values."""
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            try:
+                value = self.data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            self.data[key] = value
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.data.pop(key, None)
+            self.data[key] = value
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key=None):
+        """Drop ``key``, or every entry when no key is given."""
+        with self.lock:
+            if key is None:
+                self.data.clear()
+            else:
+                self.data.pop(key, None)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'size': len(self.data)}
+
+
+class DiskCache(object):
+    """Values stored in ``directory``, one file per key. Once the files add
+    up to more than ``max_size`` bytes the least recently used are removed.
+    Writes go through a temporary file, so readers never see a partial
+    entry. Subclasses change how values are serialized with ``dumps`` and
+    ``loads``; this one stores text."""
+    suffix = '.txt'
+
+    def __init__(self, directory, max_size=64 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+        self.size = None
+        self.hits = self.misses = self.evictions = 0
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def dumps(self, value):
+        return value.encode('utf8')
+
+    def loads(self, data):
+        return data.decode('utf8')
+
+    def path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = self.loads(f.read())
+        except (IOError, OSError):
+            self.misses += 1
+            return None
+        except Exception:
+            # truncated or written by an incompatible python
+            self.remove(path)
+            self.misses += 1
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        data = self.dumps(value)
+        fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            replace(tmp, self.path(key))
+        except Exception:
+            self.remove(tmp)
+            raise
+        if self.size is not None:
+            self.size += len(data)
+        if self.size is None or self.size > self.max_size:
+            self.evict()
+
+    def entries(self):
+        """``(mtime, size, path)`` of every cached file."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(self.suffix):
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def evict(self):
+        entries = sorted(self.entries())
+        size = sum(entry[1] for entry in entries)
+        for mtime, entry_size, path in entries:
+            if size <= self.max_size:
+                break
+            self.remove(path)
+            self.evictions += 1
+            size -= entry_size
+        self.size = size
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def invalidate(self, key=None):
+        """Drop ``key``, or every entry when no key is given."""
+        if key is not None:
+            self.remove(self.path(key))
+            self.size = None
+            return
+        for mtime, size, path in self.entries():
+            self.remove(path)
+        self.size = 0
+
+    def clear(self):
+        self.invalidate()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'size': len(self.entries())}
+
+
+class ASTCache(DiskCache):
+    """Pickled ``nodes.Block`` trees. Keys hash the source, the parser class,
+    its options and the pypugjs version, so entries never go stale.
+
+    Enable it for one parser with ``Parser(src, ast_cache=cache)`` or for
+    every parser (and so for ``pypugjs.utils.process``) with
+    ``Parser.ast_cache = cache``.
+    """
+    suffix = '.ast'
+
+    def key(self, parser):
+        return source_hash(__version__, class_name(type(parser)), options_key(parser.options, ('ast_cache',)),
+                           parser.input)
+
+    def dumps(self, value):
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    def loads(self, data):
+        return pickle.loads(data)
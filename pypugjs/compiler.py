@@ -1,7 +1,138 @@
+import ast
 import re
 import os
+import sys
+import threading
+
 import six
 
+from .nodes import Block, BlockComment, Comment, Filter, Literal, Node, Static, String, Tag, Text
+from .runtime import attrs as runtime_attrs
+
+
+# characters ``Compiler.compile_to`` and ``iter_compile`` gather per chunk
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+# regex -> {text: plan}, see ``interpolation_plan``
+interpolation_plans = {}
+MAX_INTERPOLATION_PLANS = 10000
+
+
+def interpolation_plan(regex, text):
+    """``text`` split by ``regex`` into a tuple of literal strings and
+    ``(marker, expression)`` tuples, computed once per text."""
+    plans = interpolation_plans.get(regex)
+    if plans is None:
+        plans = interpolation_plans[regex] = {}
+    plan = plans.get(text)
+    if plan is None:
+        plan = []
+        pos = 0
+        for match in regex.finditer(text):
+            if match.start() > pos:
+                plan.append(text[pos:match.start()])
+            plan.append((match.group(2), match.group(3)))
+            pos = match.end()
+        if pos < len(text):
+            plan.append(text[pos:])
+        plan = tuple(plan)
+        if len(plans) >= MAX_INTERPOLATION_PLANS:
+            plans.clear()
+        plans[text] = plan
+    return plan
+
+
+class Abandoned(Exception):
+    """Stops a compile whose ``iter_compile`` consumer went away."""
+
+
+class OutputBuffer(list):
+    """The fragments a compiler outputs, in order. ``Compiler.buffer`` and
+    backends appending to ``Compiler.buf`` directly both add one fragment;
+    they are only joined once, by ``getvalue``."""
+
+    # while positive, fragments stay in the buffer, see ``StreamingBuffer``
+    hold = 0
+
+    def getvalue(self):
+        compiled = u''.join(self)
+        if isinstance(compiled, six.binary_type):
+            compiled = six.text_type(compiled, 'utf8')
+        return compiled
+
+
+class StreamingBuffer(OutputBuffer):
+    """Passes its fragments to ``write``, joined in chunks of at least
+    ``chunk_size`` characters, so the output never has to fit in memory."""
+
+    def __init__(self, write, chunk_size, fragments=()):
+        OutputBuffer.__init__(self, fragments)
+        self.write = write
+        self.chunk_size = chunk_size
+        self.size = sum(map(len, self))
+
+    def append(self, fragment):
+        list.append(self, fragment)
+        self.size += len(fragment)
+        if self.size >= self.chunk_size and not self.hold:
+            self.flush()
+
+    def flush(self):
+        chunk = self.getvalue()
+        del self[:]
+        self.size = 0
+        if chunk:
+            self.write(chunk)
+
+
+class ChunkHandoff(object):
+    """Hands the chunks a compile running in another thread writes to the
+    thread taking them, one at a time. ``close`` makes the next write
+    raise ``Abandoned``."""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.chunk = None
+        self.done = self.closed = False
+        self.error = None
+
+    def run(self, compile):
+        """Call ``compile`` with ``write``, in the worker thread."""
+        try:
+            compile(self.write)
+        except Abandoned:
+            pass
+        except BaseException:
+            self.error = sys.exc_info()
+        with self.condition:
+            self.done = True
+            self.condition.notify_all()
+
+    def write(self, chunk):
+        with self.condition:
+            while self.chunk is not None and not self.closed:
+                self.condition.wait()
+            if self.closed:
+                raise Abandoned()
+            self.chunk = chunk
+            self.condition.notify_all()
+
+    def take(self):
+        """The next chunk, or None once the compile is done."""
+        with self.condition:
+            while self.chunk is None and not self.done:
+                self.condition.wait()
+            chunk, self.chunk = self.chunk, None
+            self.condition.notify_all()
+        if chunk is None and self.error is not None:
+            six.reraise(*self.error)
+        return chunk
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
 
 class Compiler(object):
     RE_INTERPOLATE = re.compile(r'(\\)?([#!]){(.*?)}')
@@ -24,6 +155,23 @@ class Compiler(object):
     autoclose_code = 'if,for,block,filter,autoescape,with,trans,spaceless,comment,cache,macro,localize,compress,raw'.split(',')
 
     filters = {}
+    # node class -> name of the visitor method (or a function taking the
+    # compiler and the node), see ``register_visitor``
+    node_visitors = {}
+    # (compiler class, node class) -> visitor, filled by ``visitor_for``
+    _visitors = {}
+    # what rendering static markup depends on, see ``renderer_signature``
+    static_renderers = ('RE_INTERPOLATE', 'buffer', 'interpolate', 'visit', 'visit_node', 'visit_block',
+                        'visit_tag', 'visit_attributes', 'visit_doctype', 'visit_text', 'visit_string',
+                        'visit_comment', 'visit_blockcomment', 'visit_literal', 'visit_static')
+    # render attributes whose value is a python literal at compile time,
+    # for backends evaluating attribute values as python; template
+    # languages read those literals their own way
+    constant_attributes = False
+    # whether the output only depends on the tree and the options, so
+    # ``utils.process`` may cache it; not for backends evaluating the
+    # template or reading included files while compiling
+    cacheable = True
 
     def __init__(self, node, **options):
         self.options = options
@@ -32,12 +180,18 @@ class Compiler(object):
         self.has_compiled_tag = False
         self.pp = options.get('pretty', True)
         self.debug = options.get('compile_debug', False) is not False
-        self.filters.update(options.get('filters', {}))
-        self.doctypes.update(options.get('doctypes', {}))
+        # per compiler, so options given to one don't leak into the others
+        if 'filters' in options:
+            self.filters = dict(self.filters, **options['filters'])
+        if 'doctypes' in options:
+            self.doctypes = dict(self.doctypes, **options['doctypes'])
         # self.var_processor = options.get('var_processor', lambda x: x)
-        self.self_closing.extend(options.get('self_closing', []))
-        self.autoclose_code.extend(options.get('autoclose_code', []))
-        self.inline_tags.extend(options.get('inline_tags', []))
+        if 'self_closing' in options:
+            self.self_closing = self.self_closing + list(options['self_closing'])
+        if 'autoclose_code' in options:
+            self.autoclose_code = self.autoclose_code + list(options['autoclose_code'])
+        if 'inline_tags' in options:
+            self.inline_tags = self.inline_tags + list(options['inline_tags'])
         self.use_runtime = options.get('use_runtime', True)
         self.extension = options.get('extension', None) or '.pug'
         self.indents = 0
@@ -50,6 +204,11 @@ class Compiler(object):
         if 'doctype' in self.options:
             self.set_doctype(options['doctype'])
         self.instring = False
+        # render static subtrees once, see ``collapse_static``
+        self.prerender = options.get('prerender', True)
+        # block -> its nodes with the static tags wrapped, see ``prepare_tree``
+        self.prepared = options.get('prepared')
+        self.static_signature = self.renderer_signature()
 
     def var_processor(self, var):
         if isinstance(var, six.string_types) and var.startswith('_ '):
@@ -60,13 +219,55 @@ class Compiler(object):
         return ''
 
     def compile(self):
-        self.buf = [self.compile_top()]
-        self.last_buffered_idx = -1
+        self.buf = OutputBuffer([self.compile_top()])
+        self.visit_tree()
+        return self.buf.getvalue()
+
+    def visit_tree(self):
+        if self.prerender and self.prepared is None:
+            self.prepare_tree()
         self.visit(self.node)
-        compiled = u''.join(self.buf)
-        if isinstance(compiled, six.binary_type):
-            compiled = six.text_type(compiled, 'utf8')
-        return compiled
+
+    def prepare_tree(self):
+        """Find the static subtrees of the tree and return ``prepared``:
+        the blocks holding them, mapped to their nodes with those wrapped
+        in ``nodes.Static``. The tree itself is left as is; compilers of
+        the same tree can share the result through the ``prepared``
+        option, and the markup rendered with it."""
+        self.prepared = {}
+        if self.collapse_static(self.node) and self.node.__class__ is Block:
+            self.wrap_static(self.node)
+        return self.prepared
+
+    def compile_to(self, write, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Compile, passing the output to ``write`` in chunks of about
+        ``chunk_size`` characters as the tree is visited."""
+        self.buf = StreamingBuffer(write, chunk_size, [self.compile_top()])
+        self.visit_tree()
+        self.buf.flush()
+
+    def iter_compile(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Yield the output in chunks of about ``chunk_size`` characters.
+        The visitors are recursive, so the tree is visited by a worker
+        thread that waits while a chunk is not taken yet; closing the
+        generator stops the worker and waits for it. Expressions are
+        evaluated in the worker, which doesn't see the caller's
+        thread-locals (translations, request locals...); ``compile_to``
+        needs no thread and should be preferred when they matter."""
+        handoff = ChunkHandoff()
+        worker = threading.Thread(target=handoff.run, args=(lambda write: self.compile_to(write, chunk_size),))
+        # a generator nobody closes must not keep the process alive
+        worker.daemon = True
+        worker.start()
+        try:
+            while True:
+                chunk = handoff.take()
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            handoff.close()
+            worker.join()
 
     def set_doctype(self, name):
         self.doctype = self.doctypes.get(name or 'default',
@@ -75,13 +276,7 @@ class Compiler(object):
         self.xml = self.doctype.startswith('<?xml')
 
     def buffer(self, str):
-        if self.last_buffered_idx == len(self.buf):
-            self.last_buffered += str
-            self.buf[self.last_buffered_idx - 1] = self.last_buffered
-        else:
-            self.buf.append(str)
-            self.last_buffered = str
-            self.last_buffered_idx = len(self.buf)
+        self.buf.append(str)
 
     def visit(self, node, *args, **kwargs):
         # debug = self.debug
@@ -96,17 +291,117 @@ class Compiler(object):
         # if debug: self.buf.append('__pugjs.shift();')
 
     def visit_node(self, node, *args, **kwargs):
-        name = node.__class__.__name__
-        if self.instring and name != 'Tag':
+        node_class = node.__class__
+        if self.instring and node_class is not Static and node_class.__name__ != 'Tag':
             self.buffer('\n')
             self.instring = False
-        return getattr(self, 'visit_%s' % name.lower())(node, *args, **kwargs)
+        try:
+            visitor = self._visitors[self.__class__, node_class]
+        except KeyError:
+            visitor = self.visitor_for(node_class)
+        return visitor(self, node, *args, **kwargs)
+
+    @classmethod
+    def visitor_for(cls, node_class):
+        """The function visiting ``node_class`` nodes: the one registered for
+        it or ``visit_<class name>``, trying its base classes in turn.
+        Computed once per compiler and node class."""
+        for klass in node_class.__mro__:
+            if klass is Node:
+                break
+            visitor = cls.node_visitors.get(klass, 'visit_%s' % klass.__name__.lower())
+            if isinstance(visitor, six.string_types):
+                visitor = getattr(cls, visitor, None)
+            if visitor is not None:
+                cls._visitors[cls, node_class] = visitor
+                return visitor
+        raise AttributeError("'%s' object has no attribute 'visit_%s'" %
+                             (cls.__name__, node_class.__name__.lower()))
 
     def visit_literal(self, node):
         self.buffer(node.str)
 
+    def collapse_static(self, node):
+        """Wrap the tags below ``node`` whose whole subtree is static in
+        ``nodes.Static`` in ``prepared``, so their markup is rendered once.
+        Returns whether ``node`` itself is static; the caller wraps it
+        then."""
+        cls = node.__class__
+        if cls is Text or cls is String:
+            return self.interpolation_plan(''.join(node.nodes)) is None
+        if cls is Comment or cls is Literal or cls is Static:
+            return True
+        if cls is Filter:
+            return False
+        if isinstance(node, Block):
+            static = [self.collapse_static(child) for child in node.nodes]
+            if cls is Block and all(static):
+                return True
+            self.wrap_static(node, static)
+            return False
+        block = getattr(node, 'block', None)
+        block_static = block is not None and self.collapse_static(block)
+        if cls is Tag:
+            static = (block_static and not node.buffer and node.code is None and
+                      (node.text is None or self.collapse_static(node.text)) and
+                      all(attr['static'] for attr in node.attrs))
+        elif cls is BlockComment:
+            static = block_static
+        else:
+            static = False
+            for next in getattr(node, 'next', ()):
+                self.collapse_static(next)
+        if block_static and not static:
+            self.wrap_static(block)
+        return static
+
+    def wrap_static(self, block, static=None):
+        nodes = list(block.nodes)
+        wrapped = False
+        for i, node in enumerate(nodes):
+            if node.__class__ is Tag and (static is None or static[i]):
+                nodes[i] = Static(node)
+                wrapped = True
+        if wrapped:
+            self.prepared[block] = nodes
+
+    def renderer_signature(self):
+        """The classes defining ``static_renderers`` and the visitors
+        registered for static nodes: compilers sharing them render static
+        markup the same way."""
+        cls = self.__class__
+        return (tuple(next(klass for klass in cls.__mro__ if name in klass.__dict__)
+                      for name in self.static_renderers) +
+                tuple(cls.node_visitors.get(node_class)
+                      for node_class in (Block, BlockComment, Comment, Literal, Static, String, Tag, Text)))
+
+    def static_key(self):
+        return (self.static_signature, self.pp, self.terse, self.xml, self.doctype, self.indents,
+                self.instring, self.has_compiled_tag, self.has_compiled_doctype, self.use_runtime,
+                tuple(self.inline_tags), tuple(self.self_closing))
+
+    def visit_static(self, static):
+        key = self.static_key()
+        if static.key == key:
+            self.buffer(static.str)
+            self.instring, self.has_compiled_tag, self.has_compiled_doctype = static.exit
+            return
+        start = len(self.buf)
+        self.buf.hold += 1
+        try:
+            self.visit(static.node)
+        finally:
+            self.buf.hold -= 1
+        if static.key is None:
+            # key last: another thread rendering the same tree may read
+            # str and exit as soon as the key matches
+            static.str = u''.join(self.buf[start:])
+            static.exit = self.instring, self.has_compiled_tag, self.has_compiled_doctype
+            static.key = key
+
     def visit_block(self, block):
-        for node in block.nodes:
+        prepared = self.prepared
+        for node in block.nodes if prepared is None else prepared.get(block, block.nodes):
             self.visit(node)
 
     def visit_codeblock(self, block):
@@ -202,25 +497,41 @@ class Compiler(object):
             filter.attrs['filename'] = self.options.get('filename', None)
             self.buffer(fn(text, filter.attrs))
 
+    def interpolation_plan(self, text):
+        """The ``interpolation_plan`` of ``text``, None when it can't
+        interpolate anything."""
+        if '{' not in text and self.RE_INTERPOLATE is Compiler.RE_INTERPOLATE:
+            return None
+        plan = interpolation_plan(self.RE_INTERPOLATE, text)
+        if len(plan) == 1 and not isinstance(plan[0], tuple):
+            return None
+        return plan
+
     def _interpolate(self, attr, repl):
-        return self.RE_INTERPOLATE.sub(lambda matchobj: repl(matchobj.group(3)),
-                                       attr)
+        plan = self.interpolation_plan(attr)
+        if plan is None:
+            return attr
+        return attr[:0].join([repl(segment[1]) if isinstance(segment, tuple) else segment
+                              for segment in plan])
 
     def interpolate(self, text, escape=None):
-        def repl(matchobj):
+        plan = self.interpolation_plan(text)
+        if plan is None:
+            return text
+        parts = []
+        for segment in plan:
+            if not isinstance(segment, tuple):
+                parts.append(segment)
+                continue
+            marker, expression = segment
             if escape is None:
-                if matchobj.group(2) == '!':
-                    filter_string = ''
-                else:
-                    filter_string = '|escape'
+                filter_string = '' if marker == '!' else '|escape'
             elif escape is True:
                 filter_string = '|escape'
             elif escape is False:
                 filter_string = ''
-
-            return self.variable_start_string + matchobj.group(3) + \
-                filter_string + self.variable_end_string
-        return self.RE_INTERPOLATE.sub(repl, text)
+            parts.append(self.variable_start_string + expression + filter_string + self.variable_end_string)
+        return text[:0].join(parts)
 
     def visit_text(self, text):
         text = ''.join(text.nodes)
@@ -337,10 +648,32 @@ class Compiler(object):
         if buf or terse:
             self.buf.append(self.attributes(param_string))
 
+    def constant_attribute(self, attr):
+        """Whether ``attr`` is rendered by the runtime but its value is a
+        literal, so it renders the same every time. Only with
+        ``constant_attributes``."""
+        if not self.constant_attributes or not self.use_runtime or attr['static'] or attr['name'] == 'class':
+            return False
+        if not isinstance(attr['val'], six.string_types):
+            return False
+        try:
+            ast.literal_eval(attr['val'].strip())
+        except (ValueError, SyntaxError, TypeError):
+            return False
+        return True
+
     def visit_attributes(self, attrs):
         temp_attrs = []
         for attr in attrs:
-            if (not self.use_runtime and not attr['name'] == 'class') or attr['static']:
+            if self.constant_attribute(attr):
+                # rendered now, only the varying attributes are left to
+                # the runtime
+                if temp_attrs:
+                    self.visit_dynamic_attributes(temp_attrs)
+                    temp_attrs = []
+                value = ast.literal_eval(attr['val'].strip())
+                self.buf.append(runtime_attrs([(attr['name'], value)], terse=self.terse))
+            elif (not self.use_runtime and not attr['name'] == 'class') or attr['static']:
                 if temp_attrs:
                     self.visit_dynamic_attributes(temp_attrs)
                     temp_attrs = []
@@ -369,5 +702,15 @@ class Compiler(object):
     def register_autoclosecode(cls, name):
         cls.autoclose_code.append(name)
 
+    @classmethod
+    def register_visitor(cls, node_class, visitor):
+        """Visit ``node_class`` nodes, including its subclasses, with
+        ``visitor`` in this compiler and its subclasses. ``visitor`` is a
+        method name or a function taking the compiler and the node."""
+        node_visitors = dict(cls.node_visitors)
+        node_visitors[node_class] = visitor
+        cls.node_visitors = node_visitors
+        Compiler._visitors.clear()
+
 
 # 1-
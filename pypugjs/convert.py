@@ -2,11 +2,37 @@ from __future__ import print_function
 import sys
 import logging
 import codecs
+import tempfile
 from optparse import OptionParser
-from pypugjs.utils import process
+from pypugjs.cache import replace
+from pypugjs.utils import process_to
 import os
 
 
+def write_file(filename, render):
+    """Call ``render`` with the ``write`` of a temporary file next to
+    ``filename`` and move the file over it once complete, so a failing
+    template leaves ``filename`` as it was."""
+    if os.path.exists(filename):
+        mode = os.stat(filename).st_mode & 0o777
+    else:
+        umask = os.umask(0)
+        os.umask(umask)
+        mode = 0o666 & ~umask
+    fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(os.path.abspath(filename)))
+    try:
+        outfile = codecs.getwriter('utf-8')(os.fdopen(fd, 'wb'))
+        try:
+            render(outfile.write)
+        finally:
+            outfile.close()
+        os.chmod(tmp, mode)
+        replace(tmp, filename)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
 def convert_file():
     support_compilers_list = ['django', 'jinja', 'underscore', 'mako', 'tornado', 'html']
     available_compilers = {}
@@ -55,15 +81,17 @@ def convert_file():
             template = sys.stdin.read()
         else:
             template = codecs.getreader('utf-8')(sys.stdin).read()
-        output = process(template, compiler=available_compilers[compiler],
-                         static_attrs=True, extension=extension)
+
+        def render(write):
+            process_to(write, template, compiler=available_compilers[compiler],
+                       static_attrs=True, extension=extension)
+
         if file_output:
-            outfile = codecs.open(file_output, 'w', encoding='utf-8')
-            outfile.write(output)
+            write_file(file_output, render)
         elif six.PY3:
-            sys.stdout.write(output)
+            render(sys.stdout.write)
         else:
-            codecs.getwriter('utf-8')(sys.stdout).write(output)
+            render(codecs.getwriter('utf-8')(sys.stdout).write)
     else:
         raise Exception('You must have %s installed!' % compiler)
 
@@ -1,8 +1,10 @@
 # -*- coding: utf-8 -*-
 
 import contextlib
+import time
 
 import pypugjs
+from pypugjs.cache import MemoryCache
 from pypugjs.runtime import iteration, escape
 import six
 import os
@@ -25,26 +27,210 @@ TYPE_CODE = {
     'else': lambda v: True}
 
 
+# (source, mode) -> code object, shared by every compiler
+code_cache = MemoryCache(maxsize=1024)
+
+
+def compile_code(source, mode='eval', cache=code_cache):
+    """``source`` compiled in ``mode``, once while it stays in ``cache``."""
+    if isinstance(source, six.text_type):
+        source = source.encode('utf-8')
+    if mode == 'eval':
+        # like eval(), which ignores leading blanks
+        source = source.lstrip(b' \t')
+    key = (source, mode)
+    code = cache.get(key)
+    if code is None:
+        code = compile(source, '<pypugjs>', mode)
+        cache.set(key, code)
+    return code
+
+
+class Scope(dict):
+    """Names bound in this scope, falling back to the enclosing ``parent``
+    mapping on a miss. Assignments only touch this scope, so leaving it
+    just drops it: entering and leaving cost the same whatever the size
+    of the enclosing scopes. Being a dict, lookups of names bound here
+    stay as fast as in a plain dict."""
+
+    def __init__(self, frame=(), parent=None):
+        dict.__init__(self, frame)
+        self.parent = parent
+
+    def __missing__(self, key):
+        if self.parent is None:
+            raise KeyError(key)
+        return self.parent[key]
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or (self.parent is not None and key in self.parent)
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def __iter__(self):
+        seen = set()
+        scope = self
+        while scope is not None:
+            for key in dict.__iter__(scope) if isinstance(scope, Scope) else scope:
+                if key not in seen:
+                    seen.add(key)
+                    yield key
+            scope = scope.parent if isinstance(scope, Scope) else None
+
+    def __len__(self):
+        return sum(1 for key in self)
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [self[key] for key in self]
+
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+    if six.PY2:
+        def iterkeys(self):
+            return iter(self)
+
+        def itervalues(self):
+            return (self[key] for key in self)
+
+        def iteritems(self):
+            return ((key, self[key]) for key in self)
+
+        def has_key(self, key):
+            return key in self
+
+    def copy(self):
+        """A plain dict of every name visible from this scope."""
+        return dict(self.items())
+
+
 @contextlib.contextmanager
 def local_context_manager(compiler, local_context):
+    """Bind ``local_context`` on top of the compiler's names until the
+    block exits; yields the new frame so loops can rebind it in place."""
     old_local_context = compiler.local_context
-    new_local_context = dict(compiler.local_context)
-    new_local_context.update(local_context)
-    compiler.local_context = new_local_context
-    yield
-    compiler.local_context = old_local_context
+    scope = compiler.local_context = Scope(local_context, old_local_context)
+    try:
+        yield scope
+    finally:
+        compiler.local_context = old_local_context
+
+
+class IncludeLoader(object):
+    """Finds included templates and keeps their parsed trees.
+
+    Names are looked up in ``search_path`` (the current directory by
+    default), as given and with ``extension`` appended. A cached tree is
+    reused without touching the disk for ``check_interval`` seconds; after
+    that the file is looked up again and reparsed only if its path, mtime
+    or size changed. ``check_interval=None`` never checks again, ``0``
+    checks on every include.
+    """
+
+    def __init__(self, search_path=('',), check_interval=2.0, extension='.pug', parser=pypugjs.parser.Parser):
+        self.search_path = list(search_path)
+        self.check_interval = check_interval
+        self.extension = extension
+        self.parser = parser
+        # (directory, name) -> (path, (mtime, size), block, checked at)
+        self.entries = {}
+        self.hits = self.misses = self.reloads = 0
+
+    def find(self, name, directory=None):
+        """``(path, (mtime, size))`` of the file ``name`` refers to, looked
+        up in ``directory`` first when given."""
+        search_path = self.search_path if directory is None else [directory] + self.search_path
+        for base in search_path:
+            for candidate in (name, name + self.extension):
+                path = os.path.join(base, candidate)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                return path, (stat.st_mtime, stat.st_size)
+        raise Exception("Include path doesn't exists")
+
+    def load(self, name, directory=None):
+        """The parsed tree of the template ``name`` refers to."""
+        key = directory, name
+        entry = self.entries.get(key)
+        now = time.time()
+        if entry is not None and (self.check_interval is None or now - entry[3] < self.check_interval):
+            self.hits += 1
+            return entry[2]
+        path, stat = self.find(name, directory)
+        if entry is not None and entry[:2] == (path, stat):
+            self.hits += 1
+            block = entry[2]
+        else:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.reloads += 1
+            with open(path, 'rb') as f:
+                src = f.read().decode('utf-8')
+            block = self.parser(src, filename=path).parse()
+        self.entries[key] = path, stat, block, now
+        return block
+
+    def invalidate(self, name=None, directory=None):
+        """Forget ``name``, or every template when no name is given."""
+        if name is None:
+            self.entries.clear()
+        else:
+            self.entries.pop((directory, name), None)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'reloads': self.reloads, 'size': len(self.entries)}
+
+
+# shared by every compiler, see ``Compiler.include_loader``; checks the
+# files on every include, so edits show up on the next render
+include_loader = IncludeLoader(check_interval=0)
+
+
+class Context(object):
+    """What one render reads and changes: the global names (assignments
+    write there, so they are copied), the local ones and the mixins
+    defined so far."""
+
+    def __init__(self, global_context=None, local_context=None, mixins=None):
+        self.global_context = dict(global_context or {})
+        self.local_context = Scope({}, local_context)
+        self.mixins = dict(mixins or {})
 
 
 class Compiler(pypugjs.compiler.Compiler):
+    # defaults every render starts from; renders never change them
     global_context = {}
     local_context = {}
     mixins = {}
     use_runtime = True
+    constant_attributes = True
+    cacheable = False
+    # expressions and statements are compiled through this cache, see
+    # ``code_cache.stats()``
+    code_cache = code_cache
+    # resolves and parses included templates
+    include_loader = include_loader
+
+    def __init__(self, node, context=None, **options):
+        super(Compiler, self).__init__(node, **options)
+        if context is None:
+            context = Context(self.global_context, self.local_context, self.mixins)
+        self.context = context
+        self.global_context = context.global_context
+        self.local_context = context.local_context
+        self.mixins = context.mixins
 
     def _do_eval(self, value):
-        if isinstance(value, six.string_types):
-            value = value.encode('utf-8')
         try:
+            if isinstance(value, six.string_types):
+                value = compile_code(value, 'eval', self.code_cache)
             value = eval(value, self.global_context, self.local_context)
         except:
             return None
@@ -78,16 +264,8 @@ class Compiler(pypugjs.compiler.Compiler):
         return self._interpolate(text, lambda x: str(self._do_eval(x)))
 
     def visit_include(self, node):
-        if os.path.exists(node.path):
-            src = open(node.path, 'r').read()
-        elif os.path.exists("%s.pug" % node.path):
-            src = open("%s.pug" % node.path, 'r').read()
-        else:
-            raise Exception("Include path doesn't exists")
-
-        parser = pypugjs.parser.Parser(src)
-        block = parser.parse()
-        self.visit(block)
+        directory = os.path.dirname(self.filename) if self.filename else None
+        self.visit(self.include_loader.load(node.path, directory))
 
     def visit_extends(self, node):
         raise pypugjs.exceptions.CurrentlyNotSupported()
@@ -123,18 +301,21 @@ class Compiler(pypugjs.compiler.Compiler):
         if code.block:
             self.visit(code.block)
         if not code.buffer and not code.block:
-            six.exec_(code.val.lstrip(), self.global_context, self.local_context)
+            six.exec_(compile_code(code.val.lstrip(), 'exec', self.code_cache), self.global_context,
+                      self.local_context)
 
     def visit_each(self, each):
         obj = iteration(self._do_eval(each.obj), len(each.keys))
-        for item in obj:
-            local_context = {}
-            if len(each.keys) > 1:
-                for (key, value) in zip(each.keys, item):
-                    local_context[key] = value
-            else:
-                local_context[each.keys[0]] = item
-            with local_context_manager(self, local_context):
+        keys = [key.strip() for key in each.keys]
+        with local_context_manager(self, {}) as frame:
+            for item in obj:
+                # drop what the last iteration bound
+                frame.clear()
+                if len(keys) > 1:
+                    for (key, value) in zip(keys, item):
+                        frame[key] = value
+                else:
+                    frame[keys[0]] = item
                 self.visit(each.block)
 
     def attributes(self, attrs):
@@ -162,10 +343,34 @@ class Compiler(pypugjs.compiler.Compiler):
         if params:
             self.buf.append(" " + " ".join([process_param(k, v, self.terse) for (k, v) in params]))
 
+    @property
+    def filename(self):
+        return self.options.get('filename')
+
 
 HTMLCompiler = Compiler
 
 
+class Template(object):
+    """A template parsed once and rendered any number of times, from any
+    number of threads: the tree is parsed and its static subtrees found
+    here, and each render gets its own compiler and ``Context``."""
+
+    def __init__(self, src, filename=None, parser=pypugjs.parser.Parser, compiler=Compiler, **options):
+        self.compiler = compiler
+        self.node = parser(src, filename=filename).parse()
+        prepare = compiler(self.node, filename=filename, **options)
+        # the static subtrees are found once, renders share their markup
+        prepared = prepare.prepare_tree() if prepare.prerender else None
+        self.options = dict(options, filename=filename, prepared=prepared)
+
+    def render(self, context=None, **kwargs):
+        compiler = self.compiler
+        state = Context(compiler.global_context, compiler.local_context, compiler.mixins)
+        state.global_context.update(context or {}, **kwargs)
+        return compiler(self.node, context=state, **self.options).compile()
+
+
 def process_pugjs(src):
     parser = pypugjs.parser.Parser(src)
     block = parser.parse()
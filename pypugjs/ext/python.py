@@ -0,0 +1,499 @@
+# -*- coding: utf-8 -*-
+"""Compiles templates to Python render functions.
+
+The HTML compiler walks the tree and evaluates every expression on each
+render. This backend turns the tree into the source of a Python function
+once; rendering is then a single call, with loop variables and mixin
+arguments as locals and the output appended to a list::
+
+    template = Template(src)
+    template.render(user=user)
+
+Expressions that raise render as ``None``, like in the HTML compiler.
+Unlike it, ``#{}`` escapes what it interpolates, as in pug, and ``=``
+escapes quotes too. On python 2, assignments in a mixin only rebind the
+name within the mixin.
+"""
+from __future__ import absolute_import
+
+import ast
+import keyword
+import os
+import re
+import uuid
+from itertools import islice
+
+import six
+from six.moves import builtins
+
+import pypugjs
+from pypugjs.cache import MemoryCache, source_hash
+from pypugjs.compiler import OutputBuffer
+from pypugjs.exceptions import CurrentlyNotSupported
+from pypugjs.ext.html import include_loader
+from pypugjs.runtime import escape, escape_many, iteration
+
+# marks an interpolated expression in buffered text, along with a key
+# drawn for each compile, see ``Compiler.buffer``
+MARKER = u'\x00'
+# names that can't be bound to context values
+RESERVED = frozenset(keyword.kwlist) | frozenset(['None', 'True', 'False', '__debug__'])
+
+# source hash -> render function
+functions = MemoryCache(maxsize=256)
+
+
+def text(value):
+    if isinstance(value, six.binary_type):
+        return value.decode('utf8')
+    return six.text_type(value)
+
+
+def render_attrs(attrs, classes, terse):
+    """Dynamic attributes the way the HTML compiler renders them."""
+    params = []
+    for name, value in attrs:
+        if value is True:
+            params.append((name, True))
+        elif value is not None and value is not False:
+            params.append((name, escape(value)))
+    if classes:
+        names = []
+        for value in classes:
+            if isinstance(value, list):
+                names.extend(value)
+            else:
+                names.append(value)
+        params.append(('class', u' '.join(text(name) for name in names)))
+    if not params:
+        return u''
+    return u' ' + u' '.join(name if terse and (value is True or value == name) else u'%s="%s"' % (name, text(value))
+                            for name, value in params)
+
+
+def unpack(item, count, outer):
+    """The ``count`` loop variables ``item`` binds, paired like ``zip``
+    pairs them in the HTML compiler: those ``item`` is too short for keep
+    their ``outer`` values. ``item`` is a row that failed to unpack, so
+    it must be a sequence to be read again."""
+    values = tuple(islice(item, count))
+    if len(values) < count:
+        values += (outer or (None,) * count)[len(values):]
+    return values
+
+
+def lookup(context, name):
+    if name in context:
+        return context[name]
+    return getattr(builtins, name, None)
+
+
+def outer(getter):
+    """The value of a name in the scope enclosing a mixin, None if it is
+    unbound there."""
+    try:
+        return getter()
+    except NameError:
+        return None
+
+
+def stored_names(source):
+    """The names the statements in ``source`` assign."""
+    return set(node.id for node in ast.walk(ast.parse(source))
+               if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store))
+
+
+def code_names(code):
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if hasattr(const, 'co_names'):
+            names |= code_names(const)
+    return names
+
+
+class Scope(object):
+    """What the statements of a function ``Compiler.function`` emits
+    assign: the names bound to the enclosing scope's values, and those
+    shared with it."""
+
+    def __init__(self, params):
+        self.params = set(re.split(r'\W', param.lstrip('*'))[0] for param in params)
+        self.stored = set()
+        self.shared = set()
+
+
+class Compiler(pypugjs.compiler.Compiler):
+    """Compiles a tree to the source of ``render(context)``, which returns
+    the rendered text. Static markup is buffered like in every compiler;
+    code is emitted as Python statements in ``lines``."""
+    function_name = 'render'
+    # escape the values a statement-free run of markup writes in one
+    # ``runtime.escape_many`` call, see ``flush``; python 2 has no fast
+    # path for it
+    batch_escapes = not six.PY2
+    include_loader = include_loader
+    constant_attributes = True
+    cacheable = False
+
+    def compile(self):
+        self.lines = []
+        self.level = 1
+        self.names = set()
+        self.expressions = []
+        self.writes = []
+        self.counter = 0
+        # the functions emitted for mixins and mixin blocks, innermost last
+        self.scopes = []
+        # template text can't hold it, unlike a fixed marker
+        self.marker = u'%s%s%s' % (MARKER, uuid.uuid4().hex, MARKER)
+        self.buf = OutputBuffer([self.compile_top()])
+        self.visit_tree()
+        self.flush()
+        names = sorted(name for name in self.names if not name.startswith('__pypugjs') and name not in RESERVED)
+        head = [u'def %s(__pypugjs_context):' % self.function_name,
+                u'    __pypugjs_output = []',
+                u'    __pypugjs_write = __pypugjs_output.append']
+        head.extend(u'    %s = __pypugjs_lookup(__pypugjs_context, %r)' % (name, str(name)) for name in names)
+        return u'\n'.join(head + self.lines + [u"    return u''.join(__pypugjs_output)", u''])
+
+    def emit(self, line):
+        """Emit a statement, after everything written so far."""
+        self.flush()
+        self.code(line)
+
+    def code(self, line):
+        """Emit a statement that doesn't write, leaving pending writes
+        pending."""
+        self.lines.append(u'    ' * self.level + line)
+
+    def write(self, value, kind):
+        """Write the local ``value``: ``'escape'`` it, convert it to
+        ``'text'`` or write it ``'raw'``. Writes are emitted together by
+        ``flush``."""
+        static = self.buf.getvalue()
+        del self.buf[:]
+        if static:
+            self.writes.append(static)
+        self.writes.append((value, kind))
+
+    def flush(self):
+        """Emit one ``__pypugjs_write`` for the static text and values
+        written since the last statement. Values to escape are escaped in
+        one ``escape_many`` call when there are several."""
+        static = self.buf.getvalue()
+        del self.buf[:]
+        if static:
+            self.writes.append(static)
+        if not self.writes:
+            return
+        writes, self.writes = self.writes, []
+        escaped = [value for value, kind in (w for w in writes if isinstance(w, tuple)) if kind == 'escape']
+        if len(escaped) > 1 and self.batch_escapes:
+            batch = self.temporary()
+            self.code(u'%s = __pypugjs_escape_many((%s))' % (batch, u''.join(v + u', ' for v in escaped)))
+            escaped = dict((value, u'%s[%d]' % (batch, i)) for i, value in enumerate(escaped))
+        else:
+            escaped = dict((value, u'__pypugjs_escape(%s)' % value) for value in escaped)
+        parts, values = [], []
+        for item in writes:
+            if isinstance(item, tuple):
+                value, kind = item
+                values.append(escaped[value] if kind == 'escape' else
+                              u'__pypugjs_text(%s)' % value if kind == 'text' else value)
+                parts.append(u'%s')
+            else:
+                parts.append(item.replace(u'%', u'%%'))
+        if not values:
+            self.code(u'__pypugjs_write(%r)' % u''.join(writes))
+        elif parts == [u'%s']:
+            self.code(u'__pypugjs_write(%s)' % values[0])
+        else:
+            self.code(u'__pypugjs_write(%r %% (%s))' % (u''.join(parts), u''.join(v + u', ' for v in values)))
+
+    def buffer(self, str):
+        if self.marker not in str:
+            self.buf.append(str)
+            return
+        for i, part in enumerate(str.split(self.marker)):
+            if i % 2:
+                self.write_expression(*self.expressions[int(part)])
+            elif part:
+                self.buf.append(part)
+
+    def interpolate(self, text, escape=None):
+        plan = self.interpolation_plan(text)
+        if plan is None:
+            return text
+        parts = []
+        for segment in plan:
+            if isinstance(segment, tuple):
+                marker, expression = segment
+                self.expressions.append((expression, marker != '!' if escape is None else escape))
+                segment = u'%s%d%s' % (self.marker, len(self.expressions) - 1, self.marker)
+            parts.append(segment)
+        return u''.join(parts)
+
+    def expression(self, source):
+        """``source`` as a Python expression, None when it isn't valid."""
+        try:
+            code = compile(source.strip(), '<pypugjs>', 'eval')
+        except SyntaxError:
+            return None
+        self.names |= code_names(code)
+        return u'(%s)' % source.strip()
+
+    def statement(self, source):
+        source += u'\n    pass' if source.endswith(':') else u''
+        code = compile(source, '<pypugjs>', 'exec')
+        self.names |= code_names(code)
+        if self.scopes:
+            self.scopes[-1].stored |= stored_names(source)
+
+    def temporary(self):
+        self.counter += 1
+        return u'__pypugjs_%d' % self.counter
+
+    def assign(self, name, source, default=u'None'):
+        """Emit ``name = source``, or ``default`` if it raises."""
+        expression = self.expression(source) if source else None
+        if expression is None:
+            self.code(u'%s = %s' % (name, default))
+            return
+        self.code(u'try:')
+        self.level += 1
+        self.code(u'%s = %s' % (name, expression))
+        self.level -= 1
+        self.code(u'except Exception:')
+        self.level += 1
+        self.code(u'%s = %s' % (name, default))
+        self.level -= 1
+
+    def write_expression(self, source, escaped):
+        value = self.temporary()
+        self.assign(value, source)
+        self.write(value, 'escape' if escaped else 'text')
+
+    def visit_body(self, block):
+        """Visit ``block`` one level deeper, as the body of the statement
+        emitted last."""
+        self.level += 1
+        start = len(self.lines)
+        if block is not None:
+            self.visit(block)
+        self.flush()
+        if len(self.lines) == start:
+            self.emit(u'pass')
+        self.level -= 1
+
+    def visit_code(self, code):
+        if code.buffer:
+            val = self.var_processor(code.val.lstrip())
+            self.write_expression(val, code.escape)
+            if code.block:
+                self.visit(code.block)
+            return
+        statement = code.val.strip()
+        if code.block:
+            if not statement.endswith(':'):
+                statement += ':'
+            self.statement(statement)
+            self.emit(statement)
+            self.visit_body(code.block)
+        else:
+            self.statement(statement)
+            for line in statement.splitlines():
+                self.emit(line)
+
+    def visit_assignment(self, assignment):
+        name = assignment.name
+        self.names.add(name)
+        # assignments are global in the HTML compiler, so in a mixin they
+        # rebind the name in the enclosing scopes; python 2 can't, there
+        # the mixin gets a copy like for statements
+        for scope in reversed(self.scopes):
+            if name in scope.params:
+                break
+            if six.PY2:
+                scope.stored.add(name)
+                break
+            scope.shared.add(name)
+        self.assign(name, assignment.val)
+
+    def visit_conditional(self, conditional):
+        chain, pending = [], [conditional]
+        while pending:
+            item = pending.pop(0)
+            chain.append(item)
+            pending[:0] = item.next
+        level = self.level
+        for item in chain:
+            if item is not conditional:
+                self.emit(u'else:')
+                if item.type == 'else':
+                    self.visit_body(item.block)
+                    break
+                self.level += 1
+            test = self.temporary()
+            self.assign(test, item.sentence)
+            self.emit(u'if %s%s:' % (u'not ' if item.type == 'unless' else u'', test))
+            self.visit_body(item.block)
+        self.level = level
+
+    def visit_each(self, each):
+        keys = [key.strip() for key in each.keys]
+        self.names.update(keys)
+        obj = self.temporary()
+        self.assign(obj, each.obj)
+        # the loop variables are locals like the context names, so they
+        # are restored after the loop, as the HTML compiler drops its
+        # scope; in a nested function they may be unbound before it
+        outer = self.temporary()
+        self.emit(u'try:')
+        self.level += 1
+        self.code(u'%s = (%s)' % (outer, u''.join(key + u', ' for key in keys)))
+        self.level -= 1
+        self.code(u'except NameError:')
+        self.level += 1
+        self.code(u'%s = None' % outer)
+        self.level -= 1
+        if len(keys) == 1:
+            self.emit(u'for %s in __pypugjs_iteration(%s, 1):' % (keys[0], obj))
+            self.visit_body(each.block)
+        else:
+            item = self.temporary()
+            self.emit(u'for %s in __pypugjs_iteration(%s, %d):' % (item, obj, len(keys)))
+            # rows mostly have one value per variable, bound as they are
+            self.level += 1
+            self.code(u'try:')
+            self.level += 1
+            self.code(u'%s = %s' % (u', '.join(keys), item))
+            self.level -= 1
+            self.code(u'except ValueError:')
+            self.level += 1
+            self.code(u'%s = __pypugjs_unpack(%s, %d, %s)' % (u', '.join(keys), item, len(keys), outer))
+            self.level -= 2
+            self.visit_body(each.block)
+        self.emit(u'if %s is not None:' % outer)
+        self.level += 1
+        self.code(u'%s = %s' % (u', '.join(keys) + (u',' if len(keys) == 1 else u''), outer))
+        self.level -= 1
+
+    def mixin_function(self, name):
+        # escapes ``_`` too, so that different names stay different
+        return u'__pypugjs_mixin_%s' % re.sub(r'[^a-zA-Z0-9]', lambda m: u'_%x_' % ord(m.group()), name)
+
+    def function(self, name, params, block):
+        """Emit the function ``name`` running ``block``. The names its
+        statements assign start out with their values in the enclosing
+        scope, which the HTML compiler evaluates them in; the names
+        assignments rebind are shared with that scope."""
+        self.flush()
+        scope = Scope(params)
+        self.scopes.append(scope)
+        head = len(self.lines)
+        self.code(u'def %s(%s):' % (name, u', '.join(params)))
+        self.visit_body(block)
+        self.scopes.pop()
+        prologue, getters = [], []
+        if scope.shared:
+            prologue.append(u'nonlocal %s' % u', '.join(sorted(scope.shared)))
+        for stored in sorted(scope.stored - scope.shared - scope.params):
+            if stored.startswith('__pypugjs') or stored in RESERVED:
+                continue
+            getter = self.temporary()
+            getters.append(u'%s = lambda: %s' % (getter, stored))
+            prologue.append(u'%s = __pypugjs_outer(%s)' % (stored, getter))
+        self.lines[head + 1:head + 1] = [u'    ' * (self.level + 1) + line for line in prologue]
+        self.lines[head:head] = [u'    ' * self.level + line for line in getters]
+
+    def visit_mixin(self, mixin):
+        function = self.mixin_function(mixin.name)
+        if not mixin.call:
+            params = []
+            for arg in mixin.args.split(','):
+                arg = arg.strip()
+                if arg:
+                    params.append(arg if '=' in arg or arg.startswith('*') else u'%s=None' % arg)
+            params.append(u'__pypugjs_block=None')
+            self.mixing += 1
+            self.function(function, params, mixin.block)
+            self.mixing -= 1
+            return
+        args = mixin.args.strip()
+        if mixin.block:
+            caller = self.temporary()
+            self.function(caller, [], mixin.block)
+            args = u'%s%s__pypugjs_block=%s' % (args, u', ' if args else u'', caller)
+        self.statement(u'__pypugjs_call(%s)' % args)
+        self.emit(u'%s(%s)' % (function, args))
+
+    def visit_codeblock(self, block):
+        if self.mixing:
+            self.emit(u'if __pypugjs_block is not None:')
+            self.level += 1
+            self.emit(u'__pypugjs_block()')
+            self.level -= 1
+        self.visit_block(block)
+
+    def visit_include(self, node):
+        directory = os.path.dirname(self.filename) if self.filename else None
+        self.visit(self.include_loader.load(node.path, directory))
+
+    def visit_extends(self, node):
+        raise CurrentlyNotSupported()
+
+    def visit_dynamic_attributes(self, attrs):
+        values, classes = [], []
+        for attr in attrs:
+            value = self.temporary()
+            if attr['static'] or not isinstance(attr['val'], six.string_types):
+                self.code(u'%s = %r' % (value, attr['val'] if attr['static'] else attr['name']))
+            else:
+                self.assign(value, attr['val'])
+            if attr['name'] == 'class':
+                classes.append(value)
+            else:
+                values.append(u'(%r, %s)' % (str(attr['name']), value))
+        rendered = self.temporary()
+        self.code(u'%s = __pypugjs_attrs((%s), (%s), %r)' % (
+            rendered, u''.join(v + u', ' for v in values), u''.join(c + u', ' for c in classes), self.terse))
+        self.write(rendered, 'raw')
+
+    @property
+    def filename(self):
+        return self.options.get('filename')
+
+
+def compile_function(source, filename=None):
+    """The render function defined by ``source``, compiled once per source."""
+    key = source_hash(source)
+    function = functions.get(key)
+    if function is None:
+        namespace = {
+            '__pypugjs_lookup': lookup,
+            '__pypugjs_escape': escape,
+            '__pypugjs_escape_many': escape_many,
+            '__pypugjs_text': text,
+            '__pypugjs_iteration': iteration,
+            '__pypugjs_unpack': unpack,
+            '__pypugjs_outer': outer,
+            '__pypugjs_attrs': render_attrs,
+        }
+        six.exec_(compile(source, filename or '<pypugjs>', 'exec'), namespace)
+        function = namespace[Compiler.function_name]
+        functions.set(key, function)
+    return function
+
+
+class Template(object):
+    """A template compiled to a Python function, reusable across renders."""
+
+    def __init__(self, src, filename=None, parser=pypugjs.parser.Parser, compiler=Compiler, **options):
+        block = parser(src, filename=filename).parse()
+        self.source = compiler(block, filename=filename, **options).compile()
+        self.function = compile_function(self.source, filename)
+
+    def render(self, context=None, **kwargs):
+        if kwargs:
+            context = dict(context or {}, **kwargs)
+        return self.function(context or {})
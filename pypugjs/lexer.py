@@ -1,10 +1,12 @@
 from __future__ import absolute_import
 import re
+from bisect import bisect_left
 from collections import deque
+from itertools import chain
 import six
 
 
-class Token:
+class Token(object):
     def __init__(self, **kwds):
         self.buffer = None
         self.__dict__.update(kwds)
@@ -13,10 +15,10 @@ class Token:
         return self.__dict__.__str__()
 
 
-def regexec(regex, input):
-    matches = regex.match(input)
+def regexec(regex, input, pos=0):
+    matches = regex.match(input, pos)
     if matches:
-        return (input[matches.start():matches.end()],) + matches.groups()
+        return (matches.group(0),) + matches.groups()
     return None
 
 
@@ -33,6 +35,23 @@ def detect_closing_bracket(string):
             return pos
 
 
+RE_BRACKETS = re.compile(r'[\[\]]')
+
+
+def find_closing_bracket(string, pos):
+    """Index just past the bracket closing the first ``[`` at or after
+    ``pos``, or None if it is never closed."""
+    count = 0
+    for matches in RE_BRACKETS.finditer(string, pos):
+        if matches.group() == '[':
+            count += 1
+        else:
+            count -= 1
+            if count == 0:
+                return matches.end()
+    return None
+
+
 def replace_string_brackets(splitted_string):
     sval_replaced = []
     old_delim = None
@@ -55,36 +74,38 @@ def replace_string_brackets(splitted_string):
 
 class Lexer(object):
     RE_INPUT = re.compile(r'\r\n|\r')
-    RE_COMMENT = re.compile(r'^ *\/\/(-)?([^\n]*)')
-    RE_TAG = re.compile(r'^(\w[-:\w]*|#\{.*?\})')
-    RE_DOT_BLOCK_START = re.compile(r'^\.\n')
-    RE_FILTER = re.compile(r'^:(\w+)')
-    RE_DOCTYPE = re.compile(r'^(?:!!!|doctype) *([^\n]+)?')
-    RE_ID = re.compile(r'^#([\w-]+)')
-    RE_CLASS = re.compile(r'^\.([\w-]+)')
-    RE_STRING = re.compile(r'^(?:\| ?)([^\n]+)')
-    RE_TEXT = re.compile(r'^([^\n]+)')
-    RE_EXTENDS = re.compile(r'^extends? +([^\n]+)')
-    RE_PREPEND = re.compile(r'^prepend +([^\n]+)')
-    RE_APPEND = re.compile(r'^append +([^\n]+)')
-    RE_BLOCK = re.compile(r'''^block(( +(?:(prepend|append) +)?([^\n]*))|\n)''')
-    RE_YIELD = re.compile(r'^yield *')
-    RE_INCLUDE = re.compile(r'^include +([^\n]+)')
-    RE_ASSIGNMENT = re.compile(r'^(-\s+var\s+)?(\w+) += *([^;\n]+)( *;? *)')
-    RE_MIXIN = re.compile(r'^mixin +([-\w]+)(?: *\((.*)\))?')
-    RE_CALL = re.compile(r'^\+\s*([-.\w]+)(?: *\((.*)\))?')
-    RE_CONDITIONAL = re.compile(r'^(?:- *)?(if|unless|else if|elif|else)\b([^\n]*)')
-    RE_BLANK = re.compile(r'^\n *\n')
-    # RE_WHILE = re.compile(r'^while +([^\n]+)')
-    RE_EACH = re.compile(r'^(?:- *)?(?:each|for) +([\w, ]+) +in +([^\n]+)')
-    RE_CODE = re.compile(r'^(!?=|-)([^\n]+)')
+    RE_COMMENT = re.compile(r' *\/\/(-)?([^\n]*)')
+    RE_TAG = re.compile(r'(\w[-:\w]*|#\{.*?\})')
+    RE_DOT_BLOCK_START = re.compile(r'\.\n')
+    RE_FILTER = re.compile(r':(\w+)')
+    RE_DOCTYPE = re.compile(r'(?:!!!|doctype) *([^\n]+)?')
+    RE_ID = re.compile(r'#([\w-]+)')
+    RE_CLASS = re.compile(r'\.([\w-]+)')
+    RE_STRING = re.compile(r'(?:\| ?)([^\n]+)')
+    RE_TEXT = re.compile(r'([^\n]+)')
+    RE_EXTENDS = re.compile(r'extends? +([^\n]+)')
+    RE_PREPEND = re.compile(r'prepend +([^\n]+)')
+    RE_APPEND = re.compile(r'append +([^\n]+)')
+    RE_BLOCK = re.compile(r'''block(( +(?:(prepend|append) +)?([^\n]*))|\n)''')
+    RE_YIELD = re.compile(r'yield *')
+    RE_INCLUDE = re.compile(r'include +([^\n]+)')
+    RE_ASSIGNMENT = re.compile(r'(-\s+var\s+)?(\w+) += *([^;\n]+)( *;? *)')
+    RE_MIXIN = re.compile(r'mixin +([-\w]+)(?: *\((.*)\))?')
+    RE_CALL = re.compile(r'\+\s*([-.\w]+)(?: *\((.*)\))?')
+    RE_CONDITIONAL = re.compile(r'(?:- *)?(if|unless|else if|elif|else)\b([^\n]*)')
+    RE_BLANK = re.compile(r'\n *\n')
+    # RE_WHILE = re.compile(r'while +([^\n]+)')
+    RE_EACH = re.compile(r'(?:- *)?(?:each|for) +([\w, ]+) +in +([^\n]+)')
+    RE_CODE = re.compile(r'(!?=|-)([^\n]+)')
     RE_ATTR_INTERPOLATE = re.compile(r'#\{([^}]+)\}')
+    RE_ATTR_PLAIN = re.compile(r'''[^,\n =(){}\[\]"':]+''')
     RE_ATTR_PARSE = re.compile(r'''^['"]|['"]$''')
-    RE_INDENT_TABS = re.compile(r'^\n(\t*) *')
-    RE_INDENT_SPACES = re.compile(r'^\n( *)')
-    RE_COLON = re.compile(r'^: *')
+    RE_INDENT_TABS = re.compile(r'\n(\t*) *')
+    RE_INDENT_SPACES = re.compile(r'\n( *)')
+    RE_COLON = re.compile(r': *')
     RE_INLINE = re.compile(r'(?<!\\)#\[')
     RE_INLINE_ESCAPE = re.compile(r'\\#\[')
+    RE_LONE_QUOTE = re.compile(r'\s*([\'"])\s*$')
     STRING_SPLITS = re.compile(r'([\'"])(.*?)(?<!\\)(\1)')
 
     def __init__(self, string, **options):
@@ -92,6 +113,16 @@ class Lexer(object):
             string = six.text_type(string, 'utf8')
         self.options = options
         self.input = self.RE_INPUT.sub('\n', string)
+        # With ``cursor`` (the default) the input is never copied: the lexer
+        # keeps an index into it and consumes by moving ``pos`` forward.
+        # ``cursor=False`` slices consumed text off ``input`` instead.
+        self.cursor = self.options.get('cursor', True)
+        # ``combined_keywords`` matches all keyword scanners with a single
+        # regex call, see ``keyword``
+        self.combined_keywords = self.options.get('combined_keywords', False)
+        if self.combined_keywords:
+            self.scanners = self.keyword_scanners
+        self.pos = 0
         self.colons = self.options.get('colons', False)
         self.deferred_tokens = deque()
         self.last_indents = 0
@@ -106,10 +137,17 @@ class Lexer(object):
         return Token(type=type, line=self.lineno, val=val, inline_level=self.options.get('inline_level', 0))
 
     def consume(self, len):
-        self.input = self.input[len:]
+        if self.cursor:
+            self.pos += len
+        else:
+            self.input = self.input[len:]
 
-    def scan(self, regexp, type):
-        captures = regexec(regexp, self.input)
+    def match(self, regexp):
+        return regexec(regexp, self.input, self.pos)
+
+    def scan(self, regexp, type, captures=None):
+        if captures is None:
+            captures = self.match(regexp)
         # print regexp,type, self.input, captures
         if captures:
             # print captures
@@ -120,6 +158,8 @@ class Lexer(object):
             return self.tok(type, captures[1])
 
     def defer(self, tok):
+        """Queue a token, or an iterator of tokens consumed lazily, to be
+        returned before anything else is lexed."""
         self.deferred_tokens.append(tok)
 
     def lookahead(self, n):
@@ -133,27 +173,33 @@ class Lexer(object):
         return self.stash[n - 1]
 
     def index_of_delimiters(self, start, end):
-        str, nstart, nend, pos = self.input, 0, 0, 0
-        for i, s in enumerate(str):
-            if start == s:
+        nstart, nend = 0, 0
+        delimiters = re.compile('[%s%s]' % (re.escape(start), re.escape(end)))
+        for matches in delimiters.finditer(self.input, self.pos):
+            if start == matches.group():
                 nstart += 1
-            elif end == s:
+            else:
                 nend += 1
                 if nend == nstart:
-                    pos = i
-                    break
-        return pos
+                    return matches.start() - self.pos
+        return 0
 
     def stashed(self):
         # print self.stash
         return len(self.stash) and self.stash.popleft()
 
     def deferred(self):
-        return len(self.deferred_tokens) and self.deferred_tokens.popleft()
+        while self.deferred_tokens:
+            head = self.deferred_tokens[0]
+            if isinstance(head, Token):
+                return self.deferred_tokens.popleft()
+            tok = next(head, None)
+            if tok is not None:
+                return tok
+            self.deferred_tokens.popleft()
 
     def eos(self):
-        # print 'eos',bool(self.input)
-        if self.input:
+        if self.pos < len(self.input):
             return
         if self.indent_stack:
             self.indent_stack.popleft()
@@ -162,7 +208,7 @@ class Lexer(object):
             return self.tok('eos')
 
     def consume_blank(self):
-        captures = regexec(self.RE_BLANK, self.input)
+        captures = self.match(self.RE_BLANK)
         if not captures:
             return
 
@@ -177,7 +223,7 @@ class Lexer(object):
             return self.next()
 
     def comment(self):
-        captures = regexec(self.RE_COMMENT, self.input)
+        captures = self.match(self.RE_COMMENT)
         if captures:
             self.consume(len(captures[0]))
             tok = self.tok('comment', captures[2])
@@ -185,8 +231,7 @@ class Lexer(object):
             return tok
 
     def tag(self):
-        captures = regexec(self.RE_TAG, self.input)
-        # print self.input,captures,re.match('^(\w[-:\w]*)',self.input)
+        captures = self.match(self.RE_TAG)
         if captures:
             self.consume(len(captures[0]))
             name = captures[1]
@@ -194,14 +239,14 @@ class Lexer(object):
                 name = name[:-1]
                 tok = self.tok('tag', name)
                 self.defer(self.tok(':'))
-                while self.input[0] == ' ':
-                    self.input = self.input[1:]
+                while self.input[self.pos] == ' ':
+                    self.consume(1)
             else:
                 tok = self.tok('tag', name)
             return tok
 
     def text_block_start(self):
-        captures = regexec(self.RE_DOT_BLOCK_START, self.input)
+        captures = self.match(self.RE_DOT_BLOCK_START)
         if captures is None:
             return
 
@@ -242,15 +287,16 @@ class Lexer(object):
             padding = 0
             if not is_start and len(next_indent[1]) > self.text_block_indent:
                 padding = len(next_indent[1]) - self.text_block_indent
-                self.consume(1 + padding)
-                self.input = '\n' + self.input
 
-            indent = self.indent()
+            indent = self.indent(padding)
             if is_start:
                 self.text_block_indent = indent.val
                 padding = 0
 
             itoks = self.scan_inline(self.RE_TEXT, 'string')
+            if itoks is not None:
+                # later lines change lineno, so lex the inline tags now
+                itoks = list(itoks)
             indent_char = self.indent_re == self.RE_INDENT_TABS and '\t' or ' '
             if itoks:
                 itoks[0].val = (indent_char * padding) + itoks[0].val
@@ -278,9 +324,8 @@ class Lexer(object):
     def filter(self):
         return self.scan(self.RE_FILTER, 'filter')
 
-    def doctype(self):
-        # print self.scan(self.RE_DOCTYPE, 'doctype')
-        return self.scan(self.RE_DOCTYPE, 'doctype')
+    def doctype(self, captures=None):
+        return self.scan(self.RE_DOCTYPE, 'doctype', captures)
 
     def id(self):
         return self.scan(self.RE_ID, 'id')
@@ -288,42 +333,83 @@ class Lexer(object):
     def class_name(self):
         return self.scan(self.RE_CLASS, 'class')
 
-    def process_inline(self, val):
-        sval = self.STRING_SPLITS.split(val)
-        sval_stripped = [i.strip() for i in sval]
-
-        if sval_stripped.count('"') % 2 != 0 or sval_stripped.count("'") % 2 != 0:
-            raise Exception('Unbalanced quotes found inside inline PugJS at line %s.' % self.lineno)
+    def split_inline(self, val, start):
+        """Locate the quoted strings of ``val[start:]``: ``val`` with the
+        brackets inside them masked, where each string starts, how many
+        stripped pieces from each piece on are a double or single quote,
+        and whether a text or string piece is a lone quote."""
+        pieces = self.STRING_SPLITS.split(val[start:] if start else val)
+        masked = val[:start] + replace_string_brackets(pieces)
+        quote_starts = []
+        counts = [(0, 0)] * (len(pieces) + 1)
+        pos = start
+        for i, piece in enumerate(pieces):
+            if i % 4 == 1:
+                quote_starts.append(pos)
+            pos += len(piece)
+        for i in range(len(pieces) - 1, -1, -1):
+            double, single = counts[i + 1]
+            piece = pieces[i].strip()
+            counts[i] = (double + (piece == '"'), single + (piece == "'"))
+        lone = any(piece in ('"', "'") for i, piece in enumerate(pieces) if i % 2 == 0)
+        return masked, quote_starts, counts, lone
 
-        sval_replaced = replace_string_brackets(sval)
-        start_inline = self.RE_INLINE.search(sval_replaced).start()
-
-        try:
-            closing = start_inline + detect_closing_bracket(sval_replaced[start_inline:])
-        except IndexError:
-            raise Exception('The end of the string was reached with no closing bracket found at line %s.' % self.lineno)
-
-        textl = val[:start_inline]
-        code = val[start_inline:closing][2:-1]
-        textr = val[closing:]
-
-        toks = deque()
-
-        toks.append(self.tok('string', self.RE_INLINE_ESCAPE.sub('#[', textl)))
-
-        ilexer = InlineLexer(code, inline_level=self.options.get('inline_level', 0) + 1)
+    def process_inline(self, val):
+        """Yield the tokens of a text containing ``#[...]`` inline tags.
+
+        Quoted strings are located once and the spans are then found in a
+        single walk over the text. Only the spans get an inline lexer, run
+        as their tokens are consumed."""
+        inline_level = self.options.get('inline_level', 0) + 1
+        split = None
+        start = 0
         while True:
-            tok = ilexer.advance()
-            if tok.type == 'eos':
-                break
-            toks.append(tok)
-
-        if self.RE_INLINE.search(textr):
-            toks.extend(self.process_inline(textr))
-        else:
-            toks.append(self.tok('string', self.RE_INLINE_ESCAPE.sub('#[', textr)))
+            if split is not None:
+                masked, quote_starts, counts, lone = split
+                following = bisect_left(quote_starts, start)
+                end = quote_starts[following] if following < len(quote_starts) else len(val)
+                # a lone quote makes the quote pairing depend on where the
+                # text starts, so the rest is split again from the span
+                if lone or (end - start == 1 and val[start] in ('"', "'")):
+                    split = None
+            if split is None:
+                split = masked, quote_starts, counts, lone = self.split_inline(val, start)
+                following = 0
+                end = quote_starts[0] if quote_starts else len(val)
+            # quotes from the span on: whole pieces after the text it is in,
+            # and the rest of that text when it is a lone quote
+            double, single = counts[4 * following + 1]
+            rest = self.RE_LONE_QUOTE.match(val, start, end)
+            if rest:
+                double += rest.group(1) == '"'
+                single += rest.group(1) == "'"
+            if double % 2 != 0 or single % 2 != 0:
+                raise Exception('Unbalanced quotes found inside inline PugJS at line %s.' % self.lineno)
+
+            start_inline = self.RE_INLINE.search(masked, start)
+            if start_inline is None:
+                # every remaining #[ is inside quotes
+                yield self.tok('string', self.RE_INLINE_ESCAPE.sub('#[', val[start:]))
+                return
+            start_inline = start_inline.start()
+            closing = find_closing_bracket(masked, start_inline)
+            if closing is None:
+                raise Exception('The end of the string was reached with no closing bracket found at line %s.' %
+                                self.lineno)
+
+            yield self.tok('string', self.RE_INLINE_ESCAPE.sub('#[', val[start:start_inline]))
+
+            ilexer = InlineLexer(val[start_inline + 2:closing - 1], inline_level=inline_level, cursor=self.cursor,
+                                 combined_keywords=self.combined_keywords)
+            for tok in ilexer:
+                if tok.type == 'eos':
+                    break
+                yield tok
 
-        return toks
+            start = closing
+            if not self.RE_INLINE.search(val, start):
+                yield self.tok('string', self.RE_INLINE_ESCAPE.sub('#[', val[start:]))
+                return
 
     def scan_inline(self, regexp, type):
         ret = self.scan(regexp, type)
@@ -331,22 +417,20 @@ class Lexer(object):
             return ret
 
         if self.RE_INLINE.search(ret.val):
-            ret = self.process_inline(ret.val)
-            if ret:
-                ret[0].val = ret[0].val.lstrip()
-        else:
-            ret.val = self.RE_INLINE_ESCAPE.sub('#[', ret.val)
-            ret = deque([ret])
-        return ret
+            toks = self.process_inline(ret.val)
+            first_tok = next(toks)
+            first_tok.val = first_tok.val.lstrip()
+            return chain([first_tok], toks)
+        ret.val = self.RE_INLINE_ESCAPE.sub('#[', ret.val)
+        return iter([ret])
 
     def scan_inline_process(self, regexp, type_):
         toks = self.scan_inline(regexp, type_)
-        if not toks:
+        if toks is None:
             return None
 
-        first_tok = toks.popleft()
-        for tok in toks:
-            self.defer(tok)
+        first_tok = next(toks)
+        self.defer(toks)
         return first_tok
 
     def string(self):
@@ -355,11 +439,12 @@ class Lexer(object):
     def text(self):
         return self.scan_inline_process(self.RE_TEXT, 'text')
 
-    def extends(self):
-        return self.scan(self.RE_EXTENDS, 'extends')
+    def extends(self, captures=None):
+        return self.scan(self.RE_EXTENDS, 'extends', captures)
 
-    def prepend(self):
-        captures = regexec(self.RE_PREPEND, self.input)
+    def prepend(self, captures=None):
+        if captures is None:
+            captures = self.match(self.RE_PREPEND)
         if captures:
             self.consume(len(captures[0]))
             mode, name = 'prepend', captures[1]
@@ -367,8 +452,9 @@ class Lexer(object):
             tok.mode = mode
             return tok
 
-    def append(self):
-        captures = regexec(self.RE_APPEND, self.input)
+    def append(self, captures=None):
+        if captures is None:
+            captures = self.match(self.RE_APPEND)
         if captures:
             self.consume(len(captures[0]))
             mode, name = 'append', captures[1]
@@ -376,8 +462,9 @@ class Lexer(object):
             tok.mode = mode
             return tok
 
-    def block(self):
-        captures = regexec(self.RE_BLOCK, self.input)
+    def block(self, captures=None):
+        if captures is None:
+            captures = self.match(self.RE_BLOCK)
         if captures:
             self.consume(len(captures[0]))
             mode = captures[3] or 'replace'
@@ -389,11 +476,12 @@ class Lexer(object):
     def _yield(self):
         return self.scan(self.RE_YIELD, 'yield')
 
-    def include(self):
-        return self.scan(self.RE_INCLUDE, 'include')
+    def include(self, captures=None):
+        return self.scan(self.RE_INCLUDE, 'include', captures)
 
-    def assignment(self):
-        captures = regexec(self.RE_ASSIGNMENT, self.input)
+    def assignment(self, captures=None):
+        if captures is None:
+            captures = self.match(self.RE_ASSIGNMENT)
         if captures:
             self.consume(len(captures[0]))
             name, val = captures[2:4]
@@ -402,24 +490,27 @@ class Lexer(object):
             tok.val = val
             return tok
 
-    def mixin(self):
-        captures = regexec(self.RE_MIXIN, self.input)
+    def mixin(self, captures=None):
+        if captures is None:
+            captures = self.match(self.RE_MIXIN)
         if captures:
             self.consume(len(captures[0]))
             tok = self.tok('mixin', captures[1])
             tok.args = captures[2]
             return tok
 
-    def call(self):
-        captures = regexec(self.RE_CALL, self.input)
+    def call(self, captures=None):
+        if captures is None:
+            captures = self.match(self.RE_CALL)
         if captures:
             self.consume(len(captures[0]))
             tok = self.tok('call', captures[1])
             tok.args = captures[2]
             return tok
 
-    def conditional(self):
-        captures = regexec(self.RE_CONDITIONAL, self.input)
+    def conditional(self, captures=None):
+        if captures is None:
+            captures = self.match(self.RE_CONDITIONAL)
         if captures:
             self.consume(len(captures[0]))
             type, sentence = captures[1:]
@@ -433,8 +524,9 @@ class Lexer(object):
     #         self.consume(len(captures[0]))
     #         return self.tok('code','while(%s)'%captures[1])
 
-    def each(self):
-        captures = regexec(self.RE_EACH, self.input)
+    def each(self, captures=None):
+        if captures is None:
+            captures = self.match(self.RE_EACH)
         if captures:
             self.consume(len(captures[0]))
             tok = self.tok('each', None)
@@ -442,8 +534,9 @@ class Lexer(object):
             tok.code = captures[2]
             return tok
 
-    def code(self):
-        captures = regexec(self.RE_CODE, self.input)
+    def code(self, captures=None):
+        if captures is None:
+            captures = self.match(self.RE_CODE)
         if captures:
             self.consume(len(captures[0]))
             flags, name = captures[1:]
@@ -455,166 +548,153 @@ class Lexer(object):
             return tok
 
     def attrs(self):
-        if '(' == self.input[0]:
-            index = self.index_of_delimiters('(', ')')
-            string = self.input[1:index]
-            tok = self.tok('attrs')
-            colons = self.colons
-            states = ['key']
-
-            class Namespace:
-                key = u''
-                val = u''
-                quote = u''
-                literal = True
+        if '(' != self.input[self.pos]:
+            return
+        index = self.index_of_delimiters('(', ')')
+        string = self.input[self.pos + 1:self.pos + index]
+        self.consume(index + 1)
+        tok = self.tok('attrs')
+        from .utils import odict
+        tok.attrs = attrs = odict()
+        tok.static_attrs = static_attrs = set()
+
+        # A state machine over the attribute text only. Runs of characters
+        # that are not special in any state are handled in one step.
+        colons = self.colons
+        plain = self.RE_ATTR_PLAIN.match
+        states = ['key']
+        key = val = quote = u''
+        literal = True
+        string += u','
+        i, length = 0, len(string)
+        while i < length:
+            state = states[-1]
+            run = plain(string, i)
+            if run:
+                run = run.group()
+                i += len(run)
+                if state not in ('key', 'string'):
+                    literal = literal and not run.strip(u'0123456789')
+                if state in ('key', 'key char'):
+                    key += run
+                else:
+                    val += run
+                continue
 
-                def reset(self):
-                    self.key = self.val = self.quote = u''
-                    self.literal = True
-
-                def __str__(self):
-                    return dict(key=self.key, val=self.val, quote=self.quote,
-                                literal=self.literal).__str__()
-            ns = Namespace()
-
-            def state():
-                return states[-1]
-
-            def interpolate(attr):
-                attr, num = self.RE_ATTR_INTERPOLATE.subn(
-                    lambda matchobj: '%s+"{}".format(%s)+%s' %
-                    (ns.quote, matchobj.group(1), ns.quote), attr)
-                return attr, (num > 0)
-
-            self.consume(index + 1)
-            from .utils import odict
-            tok.attrs = odict()
-            tok.static_attrs = set()
-            str_nums = list(map(str, range(10)))
-            # print '------'
-
-            def parse(c):
-                real = c
-                if colons and ':' == c:
-                    c = '='
-                ns.literal = ns.literal and (state() not in ('object', 'array',
-                                                             'expr'))
-                # print ns, c, states
-                if c in (',', '\n') or (c == ' ' and state() == 'val' and len(states) == 2 and ns.val.strip()):
-                    s = state()
-                    if s in ('expr', 'array', 'string', 'object'):
-                        ns.val += c
-                    else:
-                        states.append('key')
-                        ns.val = ns.val.strip()
-                        ns.key = ns.key.strip()
-                        if not ns.key:
-                            return
-                        # ns.literal = ns.quote
-                        if not ns.literal:
-                            if '!' == ns.key[-1]:
-                                ns.literal = True
-                                ns.key = ns.key[:-1]
-                        ns.key = ns.key.strip("'\"")
-                        if not ns.val:
-                            tok.attrs[ns.key] = True
-                        else:
-                            tok.attrs[ns.key], is_interpolated = interpolate(ns.val)
-                            ns.literal = ns.literal and not is_interpolated
-                        if ns.literal:
-                            tok.static_attrs.add(ns.key)
-                        ns.reset()
-                elif '=' == c:
-                    s = state()
-                    if s == 'key char':
-                        ns.key += real
-                    elif s in ('val', 'expr', 'array', 'string', 'object'):
-                        ns.val += real
-                    else:
-                        states.append('val')
-                elif '(' == c:
-                    if state() in ('val', 'expr'):
-                        states.append('expr')
-                    ns.val += c
-                elif ')' == c:
-                    if state() in ('val', 'expr'):
-                        states.pop()
-                    ns.val += c
-                elif '{' == c:
-                    if 'val' == state():
-                        states.append('object')
-                    ns.val += c
-                elif '}' == c:
-                    if 'object' == state():
-                        states.pop()
-                    ns.val += c
-                elif '[' == c:
-                    if 'val' == state():
-                        states.append('array')
-                    ns.val += c
-                elif ']' == c:
-                    if 'array' == state():
-                        states.pop()
-                    ns.val += c
-                elif c in ('"', "'"):
-                    s = state()
-                    if 'key' == s:
-                        states.append('key char')
-                    elif 'key char' == s:
+            c = real = string[i]
+            i += 1
+            if colons and ':' == c:
+                c = '='
+            literal = literal and state not in ('object', 'array', 'expr')
+            if c in (',', '\n') or (c == ' ' and state == 'val' and len(states) == 2 and val.strip()):
+                if state in ('expr', 'array', 'string', 'object'):
+                    val += c
+                    continue
+                states.append('key')
+                val = val.strip()
+                key = key.strip()
+                if not key:
+                    continue
+                if not literal:
+                    if '!' == key[-1]:
+                        literal = True
+                        key = key[:-1]
+                key = key.strip("'\"")
+                if not val:
+                    attrs[key] = True
+                elif '#{' in val:
+                    attrs[key], num = self.RE_ATTR_INTERPOLATE.subn(
+                        lambda matchobj: '%s+"{}".format(%s)+%s' % (quote, matchobj.group(1), quote), val)
+                    literal = literal and not num
+                else:
+                    attrs[key] = val
+                if literal:
+                    static_attrs.add(key)
+                key = val = quote = u''
+                literal = True
+            elif '=' == c:
+                if state == 'key char':
+                    key += real
+                elif state in ('val', 'expr', 'array', 'string', 'object'):
+                    val += real
+                else:
+                    states.append('val')
+            elif '(' == c:
+                if state in ('val', 'expr'):
+                    states.append('expr')
+                val += c
+            elif ')' == c:
+                if state in ('val', 'expr'):
+                    states.pop()
+                val += c
+            elif '{' == c:
+                if 'val' == state:
+                    states.append('object')
+                val += c
+            elif '}' == c:
+                if 'object' == state:
+                    states.pop()
+                val += c
+            elif '[' == c:
+                if 'val' == state:
+                    states.append('array')
+                val += c
+            elif ']' == c:
+                if 'array' == state:
+                    states.pop()
+                val += c
+            elif c in ('"', "'"):
+                if 'key' == state:
+                    states.append('key char')
+                elif 'key char' == state:
+                    states.pop()
+                elif 'string' == state:
+                    if c == quote:
                         states.pop()
-                    elif 'string' == s:
-                        if c == ns.quote:
-                            states.pop()
-                        ns.val += c
-                    else:
-                        states.append('string')
-                        ns.val += c
-                        ns.quote = c
-                elif '' == c:
-                    pass
+                    val += c
                 else:
-                    s = state()
-                    ns.literal = ns.literal and (s in ('key', 'string') or c in str_nums)
-                    # print c, s, ns.literal
-                    if s in ('key', 'key char'):
-                        ns.key += c
-                    else:
-                        ns.val += c
-
-            for char in string:
-                parse(char)
-
-            parse(',')
+                    states.append('string')
+                    val += c
+                    quote = c
+            else:
+                # a space or, without ``colons``, a colon
+                literal = literal and state in ('key', 'string')
+                if state in ('key', 'key char'):
+                    key += c
+                else:
+                    val += c
 
-            return tok
+        return tok
 
     def capture_indent(self):
         if self.indent_re:
-            captures = regexec(self.indent_re, self.input)
+            captures = self.match(self.indent_re)
         else:
             regex = self.RE_INDENT_TABS
-            captures = regexec(regex, self.input)
+            captures = self.match(regex)
             if captures and not captures[1]:
                 regex = self.RE_INDENT_SPACES
-                captures = regexec(regex, self.input)
+                captures = self.match(regex)
             if captures and captures[1]:
                 self.indent_re = regex
         return captures
 
-    def indent(self):
+    def indent(self, padding=0):
         captures = self.capture_indent()
 
         if captures:
-            indents = len(captures[1])
+            # ``padding`` leading indent characters belong to the text of a
+            # text block and are consumed without counting as indentation
+            indents = len(captures[1]) - padding
             self.lineno += 1
-            self.consume(indents + 1)
+            self.consume(len(captures[1]) + 1)
 
-            if not self.input:
+            if self.pos >= len(self.input):
                 return self.tok('newline')
-            if self.input[0] in (' ', '\t'):
+            if self.input[self.pos] in (' ', '\t'):
                 raise Exception('Invalid indentation, you can use tabs or spaces but not both')
 
-            if '\n' == self.input[0]:
+            if '\n' == self.input[self.pos]:
                 return self.tok('newline')
 
             if self.indent_stack and indents < self.indent_stack[0]:
@@ -632,12 +712,12 @@ class Lexer(object):
 
     def pipeless_text(self):
         if self.pipeless:
-            if '\n' == self.input[0]:
+            if '\n' == self.input[self.pos]:
                 return
-            i = self.input.find('\n')
+            i = self.input.find('\n', self.pos)
             if -1 == i:
                 i = len(self.input)
-            str = self.input[:i]
+            str = self.input[self.pos:i]
             self.consume(len(str))
             return self.tok('text', str)
 
@@ -647,53 +727,155 @@ class Lexer(object):
     def advance(self):
         return self.stashed() or self.next()
 
+    def __iter__(self):
+        """Yield the tokens up to and including ``eos``, lexing each only
+        when it is requested."""
+        while True:
+            tok = self.advance()
+            yield tok
+            if tok.type == 'eos':
+                break
+
+    # Scanners tried in order by ``next`` once the stateful ones found
+    # nothing, each with a regex the current character has to match for the
+    # scanner to possibly apply (``None`` means any character).
+    scanners = (
+        ('_yield', r'y'),
+        ('doctype', r'[!d]'),
+        ('extends', r'e'),
+        ('append', r'a'),
+        ('prepend', r'p'),
+        ('block', r'b'),
+        ('include', r'i'),
+        ('mixin', r'm'),
+        ('call', r'\+'),
+        ('conditional', r'[-iue]'),
+        ('each', r'[-ef]'),
+        ('assignment', r'[-\w]'),
+        ('tag', r'[\w#]'),
+        ('text_block_start', r'\.'),
+        ('filter', r':'),
+        ('code', r'[!=-]'),
+        ('id', r'#'),
+        ('class_name', r'\.'),
+        ('attrs', r'\('),
+        ('indent', r'\n'),
+        ('comment', r'[ /]'),
+        ('colon', r':'),
+        ('string', r'\|'),
+        ('text', None),
+        # ('_while', r'w'),
+    )
+
+    # Scanners whose regexes ``keyword`` combines, in ``scanners`` order.
+    # Each regex is the ``RE_`` attribute named after its scanner.
+    keywords = ('doctype', 'extends', 'append', 'prepend', 'block', 'include', 'mixin', 'call',
+                'conditional', 'each', 'assignment', 'code')
+
+    # ``scanners`` with the keyword scanners replaced by ``keyword``. Moving
+    # ``code`` ahead of ``tag``, ``text_block_start`` and ``filter`` keeps
+    # the token order as none of them can start with the same character.
+    keyword_scanners = (
+        ('_yield', r'y'),
+        ('keyword', r'[-!=+\w]'),
+        ('tag', r'[\w#]'),
+        ('text_block_start', r'\.'),
+        ('filter', r':'),
+        ('id', r'#'),
+        ('class_name', r'\.'),
+        ('attrs', r'\('),
+        ('indent', r'\n'),
+        ('comment', r'[ /]'),
+        ('colon', r':'),
+        ('string', r'\|'),
+        ('text', None),
+    )
+
+    @classmethod
+    def scanners_for(cls, char, scanners=None):
+        """Scanners that could match input starting with ``char``, in
+        ``scanners`` order. Computed once per class and character."""
+        if scanners is None:
+            scanners = cls.scanners
+        dispatch = cls.__dict__.get('_dispatch')
+        if dispatch is None:
+            dispatch = cls._dispatch = {}
+        key = scanners, char
+        try:
+            return dispatch[key]
+        except KeyError:
+            found = dispatch[key] = tuple(
+                getattr(cls, name) for name, first in scanners
+                if first is None or re.match(first, char))
+            return found
+
+    @classmethod
+    def keyword_regex(cls):
+        """The ``keywords`` regexes as one alternation of named groups, and
+        the position and number of each alternative's own groups."""
+        compiled = cls.__dict__.get('_keyword_regex')
+        if compiled is None:
+            regexes = [(name, getattr(cls, 'RE_%s' % name.upper())) for name in cls.keywords]
+            regex = re.compile('|'.join('(?P<%s>%s)' % (name, r.pattern) for name, r in regexes))
+            groups = dict((name, (regex.groupindex[name], r.groups)) for name, r in regexes)
+            compiled = cls._keyword_regex = regex, groups
+        return compiled
+
+    def keyword(self):
+        regex, groups = self.keyword_regex()
+        matches = regex.match(self.input, self.pos)
+        if matches:
+            name = matches.lastgroup
+            start, count = groups[name]
+            captures = (matches.group(name),) + matches.groups()[start:start + count]
+            return getattr(self, name)(captures)
+
+    def dispatch(self):
+        for scanner in self.scanners_for(self.input[self.pos], self.scanners):
+            tok = scanner(self)
+            if tok:
+                return tok
+
     def next(self):
         return self.deferred() \
             or self.text_block_continue() \
             or self.blank() \
             or self.eos() \
             or self.pipeless_text() \
-            or self._yield() \
-            or self.doctype() \
-            or self.extends() \
-            or self.append() \
-            or self.prepend() \
-            or self.block() \
-            or self.include() \
-            or self.mixin() \
-            or self.call() \
-            or self.conditional() \
-            or self.each() \
-            or self.assignment() \
-            or self.tag() \
-            or self.text_block_start() \
-            or self.filter() \
-            or self.code() \
-            or self.id() \
-            or self.class_name() \
-            or self.attrs() \
-            or self.indent() \
-            or self.comment() \
-            or self.colon() \
-            or self.string() \
-            or self.text()
-        # or self._while() \
+            or self.dispatch()
 
 
 class InlineLexer(Lexer):
+    scanners = (
+        ('mixin', r'm'),
+        ('call', r'\+'),
+        ('assignment', r'[-\w]'),
+        ('tag', r'[\w#]'),
+        ('code', r'[!=-]'),
+        ('id', r'#'),
+        ('class_name', r'\.'),
+        ('attrs', r'\('),
+        ('colon', r':'),
+        ('string', r'\|'),
+        ('text', None),
+    )
+
+    keywords = ('mixin', 'call', 'assignment', 'code')
+
+    keyword_scanners = (
+        ('keyword', r'[-!=+\w]'),
+        ('tag', r'[\w#]'),
+        ('id', r'#'),
+        ('class_name', r'\.'),
+        ('attrs', r'\('),
+        ('colon', r':'),
+        ('string', r'\|'),
+        ('text', None),
+    )
+
     def next(self):
         return self.deferred() \
             or self.blank() \
             or self.eos() \
             or self.pipeless_text() \
-            or self.mixin() \
-            or self.call() \
-            or self.assignment() \
-            or self.tag() \
-            or self.code() \
-            or self.id() \
-            or self.class_name() \
-            or self.attrs() \
-            or self.colon() \
-            or self.string() \
-            or self.text()
+            or self.dispatch()
@@ -1,15 +1,48 @@
-from collections import deque
+from collections import deque, namedtuple
 import six
 
 
 class Node(object):
+    # attributes outside of ``__slots__``, set by extensions for instance,
+    # go to a ``__dict__`` only created once one is set
+    __slots__ = ('line', '__dict__')
     debug = False
 
+    @classmethod
+    def slots(cls):
+        """The attribute names in the ``__slots__`` of ``cls`` and its
+        bases. Computed once per class."""
+        slots = cls.__dict__.get('_slots')
+        if slots is None:
+            slots = cls._slots = tuple(name for base in cls.__mro__
+                                       for name in base.__dict__.get('__slots__', ()) if name != '__dict__')
+        return slots
+
+    def attributes(self):
+        """The attributes set on the node, slotted or not."""
+        d = dict(self.__dict__)
+        for name in self.slots():
+            if hasattr(self, name):
+                d[name] = getattr(self, name)
+        return d
+
     def __str__(self):
-        return self.__dict__.__str__()
+        return self.attributes().__str__()
+
+
+class Attribute(namedtuple('Attribute', 'name val static')):
+    """A tag attribute, also readable by key like the dicts it replaced."""
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if isinstance(key, six.string_types):
+            return getattr(self, key)
+        return tuple.__getitem__(self, key)
 
 
 class BlockComment(Node):
+    __slots__ = ('block', 'val', 'buffer')
+
     def __init__(self, val, block, buffer):
         self.block = block
         self.val = val
@@ -17,9 +50,10 @@ class BlockComment(Node):
 
 
 class Block(Node):
+    __slots__ = ('nodes', '_yield')
+
     def __init__(self, node=None):
         self.nodes = deque()
-        self.debug = False
         if node:
             self.append(node)
 
@@ -40,10 +74,12 @@ class Block(Node):
 
 
 class CodeBlock(Block):
-    pass
+    __slots__ = ('mode', 'name')
 
 
 class Code(Node):
+    __slots__ = ('val', 'block', 'buffer', 'escape')
+
     def __init__(self, val, buffer, escape):
         self.val = val
         self.block = None
@@ -52,17 +88,23 @@ class Code(Node):
 
 
 class Comment(Node):
+    __slots__ = ('val', 'buffer')
+
     def __init__(self, val, buffer):
         self.val = val
         self.buffer = buffer
 
 
 class Doctype(Node):
+    __slots__ = ('val',)
+
     def __init__(self, val):
         self.val = val
 
 
 class Each(Node):
+    __slots__ = ('obj', 'keys', 'block')
+
     def __init__(self, obj, keys, block=None):
         self.obj = obj
         self.keys = keys
@@ -70,12 +112,16 @@ class Each(Node):
 
 
 class Assignment(Node):
+    __slots__ = ('name', 'val')
+
     def __init__(self, name, val):
         self.name = name
         self.val = val
 
 
 class Mixin(Node):
+    __slots__ = ('name', 'args', 'block', 'call')
+
     def __init__(self, name, args, block, call):
         self.name = name
         self.args = args
@@ -84,17 +130,22 @@ class Mixin(Node):
 
 
 class Extends(Node):
+    __slots__ = ('path',)
+
     def __init__(self, path):
         self.path = path
 
 
 class Include(Node):
+    __slots__ = ('path', 'extra')
+
     def __init__(self, path, extra=None):
         self.path = path
         self.extra = extra
 
 
 class Conditional(Node):
+    __slots__ = ('type', 'sentence', 'block', 'next')
     may_contain_tags = {'if': ['elif', 'else'],
                         'for': ['else'],
                         'elif': ['elif', 'else'],
@@ -115,6 +166,8 @@ class Conditional(Node):
 
 
 class Filter(Node):
+    __slots__ = ('name', 'block', 'attrs', 'is_AST_filter')
+
     def __init__(self, name, block, attrs):
         self.name = name
         self.block = block
@@ -123,11 +176,27 @@ class Filter(Node):
 
 
 class Literal(Node):
+    __slots__ = ('str',)
+
     def __init__(self, str):
         self.str = str.replace('\\', '\\\\')
 
 
+class Static(Literal):
+    """A tag whose whole subtree is static: no code, interpolation or
+    dynamic attributes. The compiler renders ``node`` into ``str`` once and
+    reuses it wherever its state matches ``key`` again."""
+    __slots__ = ('node', 'key', 'exit')
+
+    def __init__(self, node):
+        self.node = node
+        self.line = getattr(node, 'line', None)
+        self.str = self.key = self.exit = None
+
+
 class Tag(Node):
+    __slots__ = ('name', 'text_only', 'code', 'text', '_attrs', 'inline', 'block', 'buffer', 'inline_level')
+
     def __init__(self, name, block=None, inline=False, buffer=False):
         self.name = name
         self.text_only = False
@@ -152,49 +221,46 @@ class Tag(Node):
         return '"%s"' % string
 
     def set_attribute(self, name, val, static=True):
-        self._attrs.append(dict(name=name, val=val, static=static))
+        self._attrs.append(Attribute(name, val, static))
         return self
 
     def remove_attribute(self, name):
         for attr in self._attrs:
-            if attr and attr['name'] == name:
+            if attr and attr.name == name:
                 self._attrs.remove(attr)
 
     def get_attribute(self, name):
         for attr in self._attrs:
-            if attr and attr['name'] == name:
-                return attr['val']
+            if attr and attr.name == name:
+                return attr.val
 
     @property
     def attrs(self):
         attrs = []
         classes = []
         static_classes = True
-        for attr in self._attrs:
-            name = attr['name']
-            val = attr['val']
-            static = attr['static']  # and isinstance(val,six.string_types)
+        for name, val, static in self._attrs:
             if static:
                 val = self.static(val)
             if val in ("True", "False", "None"):
                 val = val == "True"
                 static = True
-            d = dict(name=name, val=val, static=static)
+            attr = Attribute(name, val, static)
             if name == 'class':
                 static_classes = static_classes and static
-                classes.append(d)
+                classes.append(attr)
             else:
-                attrs.append(d)
+                attrs.append(attr)
         if classes:
             if static_classes:
-                classes = [dict(name='class', val='"%s"' % ' '.join([a['val'][1:-1] for a in classes]), static=True)]
+                classes = [Attribute('class', '"%s"' % ' '.join([a.val[1:-1] for a in classes]), True)]
             else:
-                for attr in classes:
-                    attr['static'] = static_classes
+                classes = [attr._replace(static=static_classes) for attr in classes]
         return attrs + classes
 
 
 class Text(Node):
+    __slots__ = ('nodes',)
     parent = None
 
     def __init__(self, line=None):
@@ -207,6 +273,8 @@ class Text(Node):
 
 
 class String(Text):
+    __slots__ = ('inline',)
+
     def __init__(self, line=None, inline=False):
         super(String, self).__init__(line=line)
         self.inline = inline
@@ -1,13 +1,21 @@
 from __future__ import absolute_import
+import re
+from bisect import bisect_right
+from collections import deque
+from itertools import islice
 from .lexer import Lexer
 from . import nodes
 import six
 
 
 class Parser(object):
+    # an ``ASTCache`` used by every parser that has no ``ast_cache`` option
+    ast_cache = None
+    lexer_class = Lexer
+
     def __init__(self, str, filename=None, **options):
         self.input = str
-        self.lexer = Lexer(str, **options)
+        self.lexer = self.lexer_class(str, **options)
         self.filename = filename
         self.bloks = {}
         self.options = options
@@ -39,16 +47,33 @@ class Parser(object):
     def lookahead(self, n):
         return self.lexer.lookahead(n)
 
+    def __iter__(self):
+        """Yield the top level nodes as they are parsed. Tokens are lexed on
+        demand, so only the lookahead window is held in memory."""
+        while 'eos' != self.peek().type:
+            if 'newline' == self.peek().type:
+                self.advance()
+            else:
+                yield self.parse_expr()
+
     def parse(self):
+        cache = self.options.get('ast_cache', self.ast_cache)
+        if cache is None:
+            return self.parse_input()
+        key = cache.key(self)
+        block = cache.get(key)
+        if block is None:
+            block = self.parse_input()
+            cache.set(key, block)
+        return block
+
+    def parse_input(self):
         block = nodes.Block()
         parser = None
         block.line = self.line()
 
-        while 'eos' != self.peek().type:
-            if 'newline' == self.peek().type:
-                self.advance()
-            else:
-                block.append(self.parse_expr())
+        for node in self:
+            block.append(node)
 
         parser = self.extending
         if parser:
@@ -250,9 +275,12 @@ class Parser(object):
         self.expect('outdent')
         return text
 
-    def block(self, cls=nodes.Block):
-        block = cls()
-        block.line = self.line()
+    def block(self, cls=nodes.Block, block=None):
+        """Parse an indented block into a new ``cls`` or, when given, at
+        the end of ``block``."""
+        if block is None:
+            block = cls()
+            block.line = self.line()
         self.expect('indent')
         while 'outdent' != self.peek().type:
             if 'newline' == self.peek().type:
@@ -342,11 +370,354 @@ class Parser(object):
                 tag.block = self.parse_text_block(tag)
                 self.lexer.pipeless = False
             else:
-                block = self.block()
-                if tag.block:
-                    for node in block.nodes:
-                        tag.block.append(node)
-                else:
-                    tag.block = block
+                self.block(block=tag.block)
 
         return tag
+
+
+class RegionLexer(Lexer):
+    """A ``Lexer`` noting where each token starts and, for the tokens
+    ``indent`` makes, where the line it consumed ends."""
+    # where ``indent_re`` got decided, ``None`` until then
+    indent_re_pos = None
+
+    def __init__(self, string, **options):
+        super(RegionLexer, self).__init__(string, **options)
+        # offsets of the '(' that no ')' closes: the whole rest of the
+        # input was read to find that out
+        self.unclosed = []
+
+    def index_of_delimiters(self, start, end):
+        index = Lexer.index_of_delimiters(self, start, end)
+        if not index:
+            self.unclosed.append(self.pos)
+        return index
+
+    def dispatch(self):
+        start = self.pos
+        tok = Lexer.dispatch(self)
+        if tok is not None:
+            tok.start = start
+        return tok
+
+    def capture_indent(self):
+        indent_re = self.indent_re
+        captures = Lexer.capture_indent(self)
+        if indent_re is None and self.indent_re is not None:
+            self.indent_re_pos = self.pos
+        return captures
+
+    def indent(self, padding=0):
+        stashed = len(self.stash)
+        tok = Lexer.indent(self, padding)
+        if tok is not None:
+            # outdents left in the stash end where ``tok`` does
+            for t in list(self.stash)[stashed:] + [tok]:
+                t.end = self.pos
+        return tok
+
+
+class Region(object):
+    """The statements of an indented block: where each starts, the line the
+    lexer counted there and the regions of the blocks nested in it.
+
+    Offsets and lines are relative to where the region starts, and that
+    is relative to the statement holding the block, so an edit only moves
+    the regions holding it and the statements following it in those.
+    ``end`` is where the statement following the block starts.
+    """
+
+    def __init__(self, block, indents):
+        self.block = block
+        # the nodes ``block`` held before, like the inline ones of a tag
+        self.offset = len(block.nodes)
+        self.indents = indents
+        self.origin = self.line_origin = 0
+        self.starts = []
+        self.lines = []
+        self.children = []
+        self.end = self.end_line = None
+        # the lines of a text block come as one run of tokens, so its
+        # statements cannot be parsed on their own
+        self.splittable = True
+
+
+class RegionParser(Parser):
+    """A ``Parser`` recording the ``Region`` of every indented block."""
+    lexer_class = RegionLexer
+
+    def __init__(self, str, filename=None, **options):
+        super(RegionParser, self).__init__(str, filename=filename, **options)
+        # (region, offset, line) of the blocks being parsed
+        self.regions = []
+
+    def statements(self, region, base, line_base, end=None):
+        """Parse the statements of ``region``, which starts at offset
+        ``base`` and line ``line_base``, until its block ends or, with
+        ``end``, until one starts at or after ``end``. Returns the token
+        that stopped it."""
+        self.regions.append((region, base, line_base))
+        try:
+            while True:
+                tok = self.peek()
+                if 'newline' == tok.type:
+                    if end is not None and tok.end >= end:
+                        return tok
+                    self.advance()
+                elif tok.type in ('outdent', 'eos'):
+                    return tok
+                else:
+                    start = getattr(tok, 'start', None)
+                    if start is None:
+                        region.splittable = False
+                    elif end is not None and start >= end:
+                        return tok
+                    else:
+                        start -= base
+                    region.starts.append(start)
+                    region.lines.append(tok.line - line_base)
+                    region.children.append([])
+                    region.block.append(self.parse_expr())
+        finally:
+            self.regions.pop()
+
+    def block(self, cls=nodes.Block, block=None):
+        if block is None:
+            block = cls()
+            block.line = self.line()
+        parent, base, line_base = self.regions[-1]
+        tok = self.expect('indent')
+        region = Region(block, (tok.val,) + parent.indents)
+        region.origin = tok.end - base - parent.starts[-1]
+        region.line_origin = tok.line - line_base - parent.lines[-1]
+        parent.children[-1].append(region)
+        end = self.statements(region, tok.end, tok.line)
+        region.end = getattr(end, 'end', len(self.lexer.input)) - tok.end
+        region.end_line = end.line - tok.line
+        self.expect('outdent')
+        return block
+
+
+class IncrementalParser(object):
+    """Keeps the parse of a template up to date as its source is edited.
+
+    Parsing records where the statements of every indented block start and
+    the lexer state there. An edit re-lexes and re-parses only the
+    statements around it in the innermost block holding it, from that
+    state, and splices their nodes into ``block``. When that cannot give
+    what a full parse would, like when the edit changes where the block
+    ends, the enclosing blocks are tried in turn, up to the whole template.
+    ``reparsed`` is the span of the source the last edit parsed again.
+    """
+    RE_CONTINUATION = re.compile(r'(?:- *)?(?:else|elif)\b')
+
+    def __init__(self, src, filename=None, parser=Parser, **options):
+        self.filename = filename
+        if not issubclass(parser, RegionParser):
+            parser = type(parser.__name__, (RegionParser, parser), {})
+        self.parser = parser
+        # offsets are only meaningful while the lexer works on ``src`` itself
+        self.options = dict(options, cursor=True)
+        self.block = nodes.Block()
+        self.block.line = 1
+        self.parse(src)
+
+    def parse(self, src):
+        parser = self.parser(src, filename=self.filename, **self.options)
+        root = Region(nodes.Block(), ())
+        tok = parser.statements(root, 0, 0)
+        if 'eos' != tok.type:
+            # fails the way ``Parser`` does on the stray token
+            parser.parse_expr()
+        root.end, root.end_line = len(src), tok.line
+        self.block.nodes.clear()
+        self.block.nodes.extend(root.block.nodes)
+        root.block = self.block
+        self.src, self.root, self.reparsed = src, root, (0, len(src))
+        self.indent_re, self.indent_re_pos = parser.lexer.indent_re, parser.lexer.indent_re_pos
+        self.unclosed = parser.lexer.unclosed
+
+    def edit(self, offset, removed, inserted):
+        """Replace ``removed`` characters at ``offset`` by ``inserted`` and
+        update ``block`` in place. Returns ``block``."""
+        removed = min(removed, len(self.src) - offset)
+        src = self.src[:offset] + inserted + self.src[offset + removed:]
+        # the lexer turns '\r\n' into '\n', which would move the offsets
+        if '\r' not in self.src and '\r' not in src:
+            path = list(self.units(src, offset, offset + removed))
+            while path:
+                if self.reparse(path, src, len(inserted) - removed):
+                    return self.block
+                path.pop()
+        self.parse(src)
+        return self.block
+
+    def starts_line(self, pos):
+        return not self.src[self.src.rfind('\n', 0, pos) + 1:pos].strip(' \t')
+
+    def units(self, src, start, stop):
+        """The ``(region, first, last, offset, line)`` runs of statements
+        holding the edit of ``start:stop``, from the whole template inwards,
+        with where their region starts. ``src`` is the edited source."""
+        region, base, line_base = self.root, 0, 0
+        while region.starts and region.splittable:
+            starts = region.starts
+            first = bisect_right(starts, start - base) - 1
+            if first >= 0 and start == base + starts[first] and src[start:start + 1] in ('', ' ', '\t', '\n'):
+                # the edit indents the statement
+                first -= 1
+            if first < 0:
+                return
+            last = max(bisect_right(starts, stop - base) - 1, first)
+            if region is not self.root and last + 1 == len(starts):
+                # the indentation after the last statement decides where
+                # the block ends, leave it to the enclosing block
+                end = pos = base + region.end
+                while pos > base + starts[last] and self.src[pos - 1] in ' \t\n':
+                    pos -= 1
+                line_end = self.src.find('\n', pos, end)
+                if stop > (end if line_end == -1 else line_end):
+                    return
+            # the statement before decides on how the first token of the
+            # next one looks, like whether it continues an ``if``, so they
+            # stay together when that changes or they share a line
+            while first and (self.RE_CONTINUATION.match(self.src, base + starts[first]) or
+                             self.RE_CONTINUATION.match(src, base + starts[first]) or
+                             not self.starts_line(base + starts[first])):
+                first -= 1
+            while last + 1 < len(starts) and (self.RE_CONTINUATION.match(self.src, base + starts[last + 1]) or
+                                              not self.starts_line(base + starts[last + 1])):
+                last += 1
+            yield region, first, last, base, line_base
+            if first != last:
+                return
+            base += starts[first]
+            line_base += region.lines[first]
+            for child in region.children[first]:
+                if (child.splittable and child.starts and base + child.origin + child.starts[0] <= start and
+                        stop <= base + child.origin + child.end):
+                    region, base, line_base = child, base + child.origin, line_base + child.line_origin
+                    break
+            else:
+                return
+
+    def reparse(self, path, src, delta):
+        """Parse the statements ``path`` ends with again from ``src`` and
+        splice them in. Returns False, changing nothing, when the result
+        could differ from a full parse."""
+        region, first, last, base, line_base = path[-1]
+        start = base + region.starts[first]
+        if self.unclosed and self.unclosed[0] < start:
+            # how that '(' lexes depends on the edit
+            return False
+        if last + 1 < len(region.starts):
+            end, end_line = region.starts[last + 1], region.lines[last + 1]
+        else:
+            end, end_line = region.end, region.end_line
+        end += base
+        end_line += line_base
+
+        parser = self.parser(src, filename=self.filename, **self.options)
+        lexer = parser.lexer
+        lexer.pos, lexer.lineno = start, line_base + region.lines[first]
+        lexer.indent_stack.extend(region.indents)
+        if self.indent_re_pos is not None and self.indent_re_pos < start:
+            lexer.indent_re = self.indent_re
+        parsed = Region(nodes.Block(), region.indents)
+        try:
+            tok = parser.statements(parsed, base, line_base, end + delta)
+        except Exception:
+            return False
+        if not splittable(parsed):
+            # a text block may leave indents its tokens don't close
+            return False
+        # and the outdents that follow come from the indentation the
+        # lexer is left with, so it has to be the one of a block holding
+        # the statements
+        stack = tuple(lexer.indent_stack)
+        if (stack != region.indents[len(region.indents) - len(stack):] or
+                tok.type not in ('outdent', 'eos') and len(stack) != len(region.indents)):
+            return False
+
+        # the statements after have to start where and as they did
+        if 'newline' == tok.type:
+            same_end = tok.end == end + delta
+        elif tok.type in ('outdent', 'eos'):
+            same_end = (last + 1 == len(region.starts) and ('eos' == tok.type) == (region is self.root) and
+                        getattr(tok, 'end', len(src)) == end + delta)
+        else:
+            same_end = tok.start == end + delta
+        line_delta = tok.line - end_line
+        if not same_end or line_delta and end_line <= line_base + region.lines[first]:
+            return False
+        if lexer.indent_re is not self.indent_re:
+            if self.indent_re is not None and (lexer.indent_re is not None or self.indent_re_pos < end):
+                return False
+        if lexer.indent_re_pos is not None:
+            self.indent_re, self.indent_re_pos = lexer.indent_re, lexer.indent_re_pos
+        elif self.indent_re_pos is not None and self.indent_re_pos >= end:
+            self.indent_re_pos += delta
+        self.unclosed = ([pos for pos in lexer.unclosed if pos < end + delta] +
+                         [pos + delta for pos in self.unclosed if pos >= end])
+
+        for ancestor, index, _, ancestor_base, _ in path:
+            ancestor.end += delta
+            ancestor.end_line += line_delta
+            following = index + 1 if ancestor is not region else last + 1
+            ancestor.starts[following:] = [pos + delta for pos in ancestor.starts[following:]]
+            ancestor.lines[following:] = [line + line_delta for line in ancestor.lines[following:]]
+            if line_delta:
+                # the lexer counted these lines once it got past the edit
+                for node in islice(ancestor.block.nodes, ancestor.offset + following, None):
+                    shift_lines(node, end_line, line_delta)
+            if ancestor is region:
+                break
+            # blocks of the statement holding the edit that follow it, like
+            # the one of an ``else``, move along
+            statement_base = ancestor_base + ancestor.starts[index]
+            holding = ()
+            for child in ancestor.children[index]:
+                if statement_base + child.origin >= end:
+                    child.origin += delta
+                    child.line_origin += line_delta
+                    if line_delta:
+                        shift_lines(child.block, end_line, line_delta)
+                holding += (id(child.block),)
+            if line_delta:
+                shift_lines(ancestor.block.nodes[ancestor.offset + index], end_line, line_delta, holding)
+
+        block_nodes = list(region.block.nodes)
+        block_nodes[region.offset + first:region.offset + last + 1] = parsed.block.nodes
+        region.block.nodes.clear()
+        region.block.nodes.extend(block_nodes)
+        region.starts[first:last + 1] = parsed.starts
+        region.lines[first:last + 1] = parsed.lines
+        region.children[first:last + 1] = parsed.children
+        self.src, self.reparsed = src, (start, end + delta)
+        return True
+
+
+def splittable(region):
+    """Whether ``region`` and the regions nested in it hold no text block."""
+    return region.splittable and all(splittable(child) for children in region.children for child in children)
+
+
+def shift_lines(node, since, delta, skip=()):
+    """Move ``node`` and the nodes below it whose line is ``since`` or later
+    ``delta`` lines down, leaving out the blocks whose id is in ``skip``."""
+    stack = [node] if id(node) not in skip else []
+    Node = nodes.Node
+    while stack:
+        node = stack.pop()
+        for name in node.slots():
+            value = getattr(node, name, None)
+            if value is None:
+                continue
+            if 'line' == name:
+                if value >= since:
+                    node.line = value + delta
+            elif isinstance(value, Node):
+                if id(value) not in skip:
+                    stack.append(value)
+            elif isinstance(value, (list, deque)):
+                stack.extend(item for item in value if isinstance(item, Node))
@@ -1,7 +1,10 @@
 from __future__ import absolute_import
 
+import array
+import sys
+
 import six
-from itertools import chain
+from itertools import chain, count
 
 try:
     from collections import Mapping as MappingType
@@ -11,45 +14,121 @@ except ImportError:
 
 
 def flatten(l, ltypes=(list, tuple)):
-    ltype = type(l)
-    l = list(l)
-    i = 0
-    while i < len(l):
-        while isinstance(l[i], ltypes):
-            if not l[i]:
-                l.pop(i)
-                i -= 1
+    """``l`` with the lists and tuples nested in it spliced in, depth
+    first, and the empty ones dropped; of the same type as ``l``. Each
+    item is visited once, however long or deep ``l`` is."""
+    flat = []
+    append = flat.append
+    stack = [iter(l)]
+    while stack:
+        for item in stack[-1]:
+            if isinstance(item, ltypes):
+                stack.append(iter(item))
                 break
-            else:
-                l[i:i + 1] = l[i]
-        i += 1
-    return ltype(l)
+            append(item)
+        else:
+            stack.pop()
+    return type(l)(flat)
+
+
+# markupsafe's escape, in C when its speedups are built
+try:
+    from markupsafe import escape as markup_escape
+except ImportError:
+    markup_escape = None
+
+# what ``escape`` replaces, in order
+ESCAPES = (('&', '&amp;'), ('>', '&gt;'), ('<', '&lt;'), ("'", '&#39;'), ('"', '&#34;'))
+# below this length the replaces beat markup_escape, which builds a Markup
+MARKUP_ESCAPE_MIN_LENGTH = 64
 
 
 def escape(s):
     """Convert the characters &, <, >, ' and " in string s to HTML-safe
     sequences.  Use this if you need to display text that might contain
     such characters in HTML.  Marks return value as markup string.
+
+    Text without any of them is returned as is.
     """
-    if hasattr(s, '__html__'):
-        return s.__html__()
-    if isinstance(s, six.binary_type):
-        s = six.text_type(str(s), 'utf8')
-    elif isinstance(s, six.text_type):
-        s = s
-    else:
-        s = str(s)
+    if s.__class__ is not six.text_type:
+        if hasattr(s, '__html__'):
+            return s.__html__()
+        if isinstance(s, six.binary_type):
+            s = s.decode('utf8')
+        elif not isinstance(s, six.text_type):
+            s = str(s)
+    if '&' in s or '<' in s or '>' in s or "'" in s or '"' in s:
+        if markup_escape is not None and len(s) >= MARKUP_ESCAPE_MIN_LENGTH and s.__class__ is six.text_type:
+            return six.text_type(markup_escape(s))
+        for char, entity in ESCAPES:
+            s = s.replace(char, entity)
+    return s
+
+
+def escape_many(values):
+    """``[escape(value) for value in values]``. Text is checked for special
+    characters all at once, so a batch of clean strings costs one scan
+    rather than one call per value."""
+    values = list(values)
+    if not six.PY2:
+        # python 2 would join byte strings, which escape decodes
+        try:
+            joined = u''.join(values)
+        except TypeError:
+            pass
+        else:
+            if not ('&' in joined or '<' in joined or '>' in joined or "'" in joined or '"' in joined):
+                return values
+    return [escape(value) for value in values]
+
+
+# (key of the arguments, see ``attrs_key``) -> output of ``attrs``; set
+# to a dict to reuse the output of ``attrs`` for repeated attributes
+attrs_cache = None
+MAX_ATTRS_CACHE = 1024
+# values rendering the same whenever they compare equal
+ATTRS_CACHE_TYPES = frozenset((six.text_type, six.binary_type, bool, float, type(None)) + six.integer_types)
+
 
-    return (s
-        .replace('&', '&amp;')
-        .replace('>', '&gt;')
-        .replace('<', '&lt;')
-        .replace("'", '&#39;')
-        .replace('"', '&#34;')
-    )
+def attrs_key(attrs, terse=False, undefined=None):
+    """Hashable key of the arguments of ``attrs``, telling apart values
+    that compare equal but render differently, like ``1``, ``True`` and
+    ``1.0`` or ``0.0`` and ``-0.0``.
+    None unless every value is a string, number, bool or None, or a list
+    or tuple of them."""
+    key = [terse, undefined]
+    for name, value in attrs:
+        cls = value.__class__
+        if cls is list or cls is tuple:
+            if not all(item.__class__ in ATTRS_CACHE_TYPES for item in value):
+                return None
+            value = tuple((item.__class__, repr(item) if item.__class__ is float else item) for item in value)
+        elif cls is float:
+            # 0.0 and -0.0 compare equal
+            value = repr(value)
+        elif cls not in ATTRS_CACHE_TYPES:
+            return None
+        key.append((name, cls, value))
+    return tuple(key)
 
 
 def attrs(attrs=[], terse=False, undefined=None):
+    cache = attrs_cache
+    if cache is None:
+        return render_attrs(attrs, terse, undefined)
+    key = attrs_key(attrs, terse, undefined)
+    if key is None:
+        return render_attrs(attrs, terse, undefined)
+    rendered = cache.get(key)
+    if rendered is None:
+        rendered = render_attrs(attrs, terse, undefined)
+        if len(cache) >= MAX_ATTRS_CACHE:
+            cache.clear()
+        cache[key] = rendered
+    return rendered
+
+
+def render_attrs(attrs=[], terse=False, undefined=None):
     buf = []
     if bool(attrs):
         buf.append(u'')
@@ -115,6 +194,10 @@ def iteration(obj, num_keys):
     if is_mapping(obj):
         return obj
 
+    rows = bulk_rows(obj)
+    if rows is not None:
+        return sequence_iteration(rows, num_keys)
+
     _marker = []
 
     iter_obj = iter(obj)
@@ -136,3 +219,62 @@ def iteration(obj, num_keys):
 
     else:
         return iter_obj
+
+
+# numpy dtype kinds whose ``tolist`` values print like the array's items:
+# bools, integers, text, bytes and objects; float64 is checked apart, as
+# smaller floats print differently once converted
+NUMPY_TOLIST_KINDS = frozenset('biuUSO')
+
+
+def bulk_rows(obj):
+    """The items of ``obj`` as a sequence: lists, tuples, ``array.array``
+    and flat (python 3) memoryviews as they are, deeper memoryviews,
+    flat numpy arrays and pandas frames and series converted in one
+    call; None for anything else. Neither numpy nor pandas is imported
+    here, objects of theirs only exist once they are loaded.
+
+    Pandas frames give their rows, as named tuples when the column names
+    allow it, rather than their column names."""
+    if isinstance(obj, (list, tuple, array.array)):
+        return obj
+    if six.PY3 and isinstance(obj, memoryview):
+        if obj.ndim == 1:
+            return obj
+        if obj.ndim == 0:
+            # a scalar, which iterating fails on as it should
+            return None
+        try:
+            return obj.tolist()
+        except NotImplementedError:
+            # formats tolist doesn't know
+            return None
+    numpy = sys.modules.get('numpy')
+    if numpy is not None and isinstance(obj, numpy.ndarray):
+        dtype = obj.dtype
+        # the rows of deeper arrays are arrays, not the lists tolist gives
+        if obj.ndim == 1 and (dtype.kind in NUMPY_TOLIST_KINDS or dtype == numpy.float64):
+            return obj.tolist()
+        return None
+    pandas = sys.modules.get('pandas')
+    if pandas is not None:
+        if isinstance(obj, pandas.DataFrame):
+            return list(obj.itertuples(index=False))
+        if isinstance(obj, pandas.Series):
+            return obj.tolist()
+    return None
+
+
+def sequence_iteration(rows, num_keys):
+    """``iteration`` of a sequence, looking at its first item only and
+    leaving the loop to C where it can."""
+    if not rows:
+        return rows
+    head = rows[0]
+    if is_iterable(head):
+        if num_keys == get_cardinality(head) + 1:
+            return (tuple(item) + (ix,) for ix, item in enumerate(rows))
+        return rows
+    elif num_keys == 2:
+        return six.moves.zip(rows, count())
+    return rows
@@ -0,0 +1,491 @@
+"""Micro-benchmarks for pypugjs.
+
+Not collected by the test runner; run them from this directory::
+
+    python bench.py             # every benchmark
+    python bench.py dispatch    # benchmarks whose name contains "dispatch"
+"""
+from __future__ import print_function
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+import six
+
+from pypugjs.cache import ASTCache, MemoryCache
+from pypugjs.compiler import Compiler
+from pypugjs.lexer import Lexer
+from pypugjs.parser import Parser
+from test_lexer import UndispatchedLexer
+
+cases_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cases')
+
+
+def read_cases():
+    sources = []
+    for filename in sorted(os.listdir(cases_dir)):
+        if filename.endswith('.pug'):
+            with open(os.path.join(cases_dir, filename)) as f:
+                src = f.read()
+            if isinstance(src, six.binary_type):
+                src = src.decode('utf-8')
+            sources.append(src)
+    return sources
+
+
+def best_of(func, repeat=5, number=1):
+    return min(timeit.repeat(func, repeat=repeat, number=number)) / number
+
+
+def report(name, seconds, per=None, unit=None):
+    if per:
+        print('%-40s %10.3f ms  %8.3f us/%s' % (name, seconds * 1e3, seconds * 1e6 / per, unit))
+    else:
+        print('%-40s %10.3f ms' % (name, seconds * 1e3))
+
+
+def lex_all(sources, lexer=Lexer, **options):
+    count = 0
+    for src in sources:
+        lx = lexer(src, **options)
+        while lx.advance().type != 'eos':
+            count += 1
+    return count
+
+
+def bench_lexer_dispatch():
+    sources = read_cases() * 20
+    ntokens = lex_all(sources)
+    report('lex cases, all scanners', best_of(lambda: lex_all(sources, UndispatchedLexer)), ntokens, 'token')
+    report('lex cases, first-character dispatch', best_of(lambda: lex_all(sources)), ntokens, 'token')
+
+
+def bench_lexer_keywords():
+    sources = read_cases() * 20
+    ntokens = lex_all(sources)
+    report('lex cases, one regex per keyword', best_of(lambda: lex_all(sources)), ntokens, 'token')
+    report('lex cases, combined keyword regex',
+           best_of(lambda: lex_all(sources, combined_keywords=True)), ntokens, 'token')
+
+
+def bench_lexer_attrs():
+    attrs = u', '.join(u"data-col%d='value %d'" % (i, i) for i in range(50))
+    src = u'tr(%s)' % attrs
+    src = u'\n'.join([src] * 200)
+    report('lex 200 tags with 50 attributes', best_of(lambda: lex_all([src])), 200 * len(attrs), 'char')
+
+
+def bench_lexer_inline():
+    line = u' '.join(u"see #[a(href='/p/%d') page %d] or #[em this]" % (i, i) for i in range(40))
+    src = u'\n'.join([u'p ' + line] * 100)
+    report('lex 100 lines with 80 inline tags', best_of(lambda: lex_all([src])), 100 * 80, 'inline tag')
+
+
+def parse_all(sources, **options):
+    for src in sources:
+        Parser(src, **options).parse()
+
+
+def bench_parser_ast_cache():
+    sources = read_cases()
+    directory = tempfile.mkdtemp()
+    try:
+        cache = ASTCache(directory)
+        parse_all(sources, ast_cache=cache)
+        report('parse cases', best_of(lambda: parse_all(sources)), len(sources), 'template')
+        report('parse cases, AST cache hit', best_of(lambda: parse_all(sources, ast_cache=cache)),
+               len(sources), 'template')
+    finally:
+        shutil.rmtree(directory)
+
+
+def tags_template(count):
+    """``count`` tags: rows of static cells with some text, attributes and code."""
+    rows = []
+    for i in range(count // 5):
+        rows.append(u'tr.row(data-row="%d")\n'
+                    u'  td.a cell %d\n'
+                    u'  td.b: span static\n'
+                    u'  td(class=cls)= value\n' % (i, i))
+    return u'table\n' + u''.join(u'  ' + line for row in rows for line in row.splitlines(True))
+
+
+def bench_parser_incremental():
+    from pypugjs.parser import IncrementalParser
+    src = tags_template(10000)
+    incremental = IncrementalParser(src)
+    offset = src.index(u'cell 1000\n') + len(u'cell 1000')
+
+    def type_and_erase():
+        incremental.edit(offset, 0, u'x')
+        incremental.edit(offset, 1, u'')
+
+    def new_line_and_erase():
+        incremental.edit(offset, 0, u'\n    td new')
+        incremental.edit(offset, 11, u'')
+
+    report('parse 10k tags', best_of(lambda: Parser(src).parse(), repeat=3))
+    report('incremental edit in 10k tags, same lines', best_of(type_and_erase, number=100), 2, 'edit')
+    report('incremental edit in 10k tags, new line', best_of(new_line_and_erase, number=10), 2, 'edit')
+
+
+def compiler_backends():
+    from pypugjs.ext import django, html, jinja, mako, tornado, underscore
+    return [('base', Compiler), ('html', html.Compiler), ('jinja', jinja.Compiler), ('django', django.Compiler),
+            ('mako', mako.Compiler), ('tornado', tornado.Compiler), ('underscore', underscore.Compiler)]
+
+
+def bench_compiler_10k_tags():
+    block = Parser(tags_template(10000)).parse()
+    for name, compiler in compiler_backends():
+        report('compile 10k tags, %s' % name, best_of(lambda: compiler(block).compile()), 10000, 'tag')
+
+
+class GetattrCompiler(Compiler):
+    """Looks the visitor up by name for every node, as before the
+    per-class dispatch table."""
+
+    def visit_node(self, node, *args, **kwargs):
+        name = node.__class__.__name__
+        if self.instring and name != 'Tag':
+            self.buffer('\n')
+            self.instring = False
+        return getattr(self, 'visit_%s' % name.lower())(node, *args, **kwargs)
+
+
+def bench_compiler_dispatch():
+    src = u''.join(u'p\n  | line %d\n  span\n    em= x\n' % i for i in range(2000))
+    block = Parser(src).parse()
+    report('compile 2000 rows, getattr per node', best_of(lambda: GetattrCompiler(block).compile()), 2000, 'row')
+    report('compile 2000 rows, dispatch table', best_of(lambda: Compiler(block).compile()), 2000, 'row')
+
+
+def bench_compiler_static():
+    from pypugjs.ext.html import Compiler as HTMLCompiler
+    links = u''.join(u'      li: a(href="/page/%d") Page %d\n' % (i, i) for i in range(200))
+    src = u'html\n  body\n    h1= title\n    ul.footer\n' + links
+    for name, compiler in (('base', Compiler), ('html', HTMLCompiler)):
+        block = Parser(src).parse()
+        report('compile static footer, %s, walk' % name,
+               best_of(lambda: compiler(block, prerender=False).compile(), number=20))
+        report('compile static footer, %s, prerendered' % name,
+               best_of(lambda: compiler(block).compile(), number=20))
+        prepared = compiler(block).prepare_tree()
+        report('compile static footer, %s, prepared once' % name,
+               best_of(lambda: compiler(block, prepared=prepared).compile(), number=20))
+
+
+class RegexCompiler(Compiler):
+    """Interpolates with ``RE_INTERPOLATE.sub`` on every call, as before
+    interpolation plans."""
+
+    def interpolate(self, text, escape=None):
+        def repl(matchobj):
+            filter_string = '' if matchobj.group(2) == '!' else '|escape'
+            return self.variable_start_string + matchobj.group(3) + filter_string + self.variable_end_string
+        return self.RE_INTERPOLATE.sub(repl, text)
+
+
+def bench_compiler_interpolation():
+    src = u''.join(u'p Item %d costs #{price} for #{user.name}\np.note plain text line %d\n' % (i, i)
+                   for i in range(2000))
+    block = Parser(src).parse()
+    report('compile 4000 text lines, regex per text',
+           best_of(lambda: RegexCompiler(block, prerender=False).compile()), 4000, 'line')
+    report('compile 4000 text lines, interpolation plans',
+           best_of(lambda: Compiler(block, prerender=False).compile()), 4000, 'line')
+
+
+def peak_memory(func):
+    try:
+        import tracemalloc
+    except ImportError:
+        return None
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_compiler_streaming():
+    block = Parser(tags_template(50000)).parse()
+
+    def compile_to():
+        Compiler(block).compile_to(lambda chunk: None)
+
+    def iter_compile():
+        for chunk in Compiler(block).iter_compile():
+            pass
+
+    for name, func in (('compile()', lambda: Compiler(block).compile()), ('compile_to()', compile_to),
+                       ('iter_compile()', iter_compile)):
+        report('compile 50k tags, %s' % name, best_of(func, repeat=3))
+        peak = peak_memory(func)
+        if peak is not None:
+            print('%-40s %10.1f MB peak' % ('', peak / 1e6))
+
+
+def bench_html_code_cache():
+    from pypugjs.ext import html
+    src = u'ul\n  each row in rows\n    if row % 3\n      li(class="row-" + str(row))= row * 2\n'
+    block = Parser(src).parse()
+
+    def render(cache):
+        compiler = html.Compiler(block)
+        compiler.code_cache = cache
+        compiler.global_context = {'rows': range(10000)}
+        return compiler.compile()
+
+    report('render 10k rows, compile per eval', best_of(lambda: render(MemoryCache(maxsize=0)), repeat=3),
+           10000, 'row')
+    report('render 10k rows, code cache', best_of(lambda: render(html.code_cache), repeat=3), 10000, 'row')
+    print(html.code_cache.stats())
+
+
+def bench_html_scopes():
+    from pypugjs.ext import html
+    from pypugjs.runtime import iteration
+
+    class CopyingCompiler(html.Compiler):
+        """Copies the local names into a new dict for every iteration, as
+        before ``html.Scope``."""
+
+        def visit_each(self, each):
+            for item in iteration(self._do_eval(each.obj), len(each.keys)):
+                old = self.local_context
+                self.local_context = dict(old)
+                self.local_context[each.keys[0]] = item
+                self.visit(each.block)
+                self.local_context = old
+
+    src = u'each row in rows\n  each cell in row\n    | #{cell}\n'
+    block = Parser(src).parse()
+    rows = [list(range(20))] * 500
+    for size in (10, 1000):
+        local_context = dict(('name%d' % i, i) for i in range(size))
+        for name, compiler in (('dict copies', CopyingCompiler), ('scopes', html.Compiler)):
+            def render():
+                c = compiler(block)
+                c.global_context = {'rows': rows}
+                c.local_context = local_context
+                return c.compile()
+            report('render 10k cells, %d names, %s' % (size, name), best_of(render), 10000, 'cell')
+
+
+def bench_html_threads():
+    from multiprocessing.pool import ThreadPool
+    from pypugjs.ext import html
+    template = html.Template(u'- title = "Page " + str(page)\n'
+                             u'html\n'
+                             u'  body\n'
+                             u'    h1= title\n'
+                             u'    ul\n'
+                             u'      each item in items\n'
+                             u'        li(class="item")= item\n')
+    pages = [{'page': i, 'items': list(range(20))} for i in range(400)]
+
+    for threads in (1, 4, 16):
+        pool = ThreadPool(threads)
+        try:
+            seconds = best_of(lambda: pool.map(lambda page: template.render(page), pages), repeat=3)
+        finally:
+            pool.close()
+            pool.join()
+        report('render 400 pages, %d threads' % threads, seconds, 400, 'page')
+        print('%-40s %10.0f pages/s' % ('', 400 / seconds))
+
+
+def bench_html_includes():
+    from pypugjs.ext import html
+
+    class ReparsingCompiler(html.Compiler):
+        """Finds, reads and parses the included file on every include, as
+        before ``html.IncludeLoader``."""
+
+        def visit_include(self, node):
+            path = os.path.join(cases_dir, node.path)
+            if not os.path.exists(path):
+                path += '.pug'
+            with open(path, 'rb') as f:
+                src = f.read().decode('utf-8')
+            self.visit(Parser(src).parse())
+
+    block = Parser(u'ul\n  each value in values\n    include auxfiles/layout\n').parse()
+    loader = html.IncludeLoader([cases_dir])
+    for name, compiler in (('reparse', ReparsingCompiler), ('loader', html.Compiler)):
+        def render():
+            c = compiler(block)
+            c.include_loader = loader
+            c.global_context = {'values': range(1000)}
+            return c.compile()
+        report('render 1000 includes, %s' % name, best_of(render, repeat=3), 1000, 'include')
+
+
+def replace_escape(s):
+    """``runtime.escape`` as it was: five replaces whatever the input."""
+    if hasattr(s, '__html__'):
+        return s.__html__()
+    if isinstance(s, six.binary_type):
+        s = six.text_type(s, 'utf8')
+    elif not isinstance(s, six.text_type):
+        s = str(s)
+    return s.replace('&', '&amp;').replace('>', '&gt;').replace('<', '&lt;').replace("'", '&#39;').replace('"', '&#34;')
+
+
+def bench_runtime_escape():
+    from pypugjs import runtime
+    strings = [('short clean', u'Jane Doe'), ('short dirty', u'Tom & Jerry'),
+               ('long clean', u'lorem ipsum dolor sit amet ' * 40),
+               ('long dirty', u'<p class="x">Tom & Jerry\'s</p> ' * 40)]
+    markup_escape = runtime.markup_escape
+    for name, s in strings:
+        report('escape %s, replaces' % name, best_of(lambda: replace_escape(s), number=10000), 1, 'call')
+        runtime.markup_escape = None
+        report('escape %s, escape' % name, best_of(lambda: runtime.escape(s), number=10000), 1, 'call')
+        runtime.markup_escape = markup_escape
+        if markup_escape is not None:
+            report('escape %s, escape + markupsafe' % name, best_of(lambda: runtime.escape(s), number=10000), 1,
+                   'call')
+
+
+def bench_batched_escapes():
+    from pypugjs.ext import python
+    src = (u'table\n  each id, name, email, city in rows\n    tr\n'
+           u'      td= id\n      td= name\n      td= email\n      td= city\n')
+    rows = [(u'%d' % i, u'User %d' % i, u'user%d@example.com' % i, u'City %d' % (i % 50)) for i in range(50000)]
+    for batch in (False, True):
+        class Compiler(python.Compiler):
+            batch_escapes = batch
+        template = python.Template(src, compiler=Compiler)
+        report('python, 50k rows, %s' % ('escape_many' if batch else 'escape per cell'),
+               best_of(lambda: template.render(rows=rows), repeat=3), 50000, 'row')
+
+
+def bench_runtime_flatten():
+    from pypugjs import runtime
+    from test_runtime import splicing_flatten
+    deep = 'x'
+    for i in range(1000):
+        deep = [deep, 'y']
+    cases = [('5 classes', ['a', ['b', 'c'], ('d', 'e')]),
+             ('10k classes, flat', ['c%d' % i for i in range(10000)]),
+             ('100k classes, in pairs', [['c%d' % i, 'd%d' % i] for i in range(50000)]),
+             ('1000 levels deep', deep)]
+    for name, l in cases:
+        report('flatten %s, splicing' % name, best_of(lambda: splicing_flatten(l), number=10))
+        report('flatten %s, stack' % name, best_of(lambda: runtime.flatten(l), number=10))
+
+
+def bench_runtime_attrs():
+    from pypugjs import runtime
+    pairs = [[('class', ['btn', kind]), ('href', '/items?page=1&sort=name'), ('title', kind), ('disabled', False)]
+             for kind in ('primary', 'secondary', 'danger', 'link')]
+
+    def render():
+        for attrs in pairs:
+            runtime.attrs(attrs)
+
+    original = runtime.attrs_cache
+    try:
+        runtime.attrs_cache = None
+        report('attrs of 4 pairs, uncached', best_of(render), 4, 'call')
+        runtime.attrs_cache = {}
+        report('attrs of 4 pairs, cached', best_of(render), 4, 'call')
+    finally:
+        runtime.attrs_cache = original
+
+
+def chained_iteration(obj, num_keys):
+    """``runtime.iteration`` before ``runtime.bulk_rows``."""
+    from itertools import chain
+    from pypugjs.runtime import get_cardinality, is_iterable, is_mapping
+    if is_mapping(obj):
+        return obj
+    iter_obj = iter(obj)
+    head = next(iter_obj, None)
+    iter_obj = chain([head], iter_obj)
+    if is_iterable(head):
+        if num_keys == get_cardinality(head) + 1:
+            return (tuple(item) + (ix,) for ix, item in enumerate(iter_obj))
+        return iter_obj
+    elif num_keys == 2:
+        return ((item, ix) for ix, item in enumerate(iter_obj))
+    return iter_obj
+
+
+def bench_runtime_iteration():
+    import array
+    from collections import deque
+    from pypugjs.runtime import iteration
+    size = 1000000
+    inputs = [('list', list(range(size))),
+              ('list of pairs', [(i, -i) for i in range(size)]),
+              ('array.array', array.array('d', range(size)))]
+    try:
+        import numpy
+        inputs.append(('numpy array', numpy.arange(size)))
+        inputs.append(('numpy 2d array', numpy.arange(size * 2).reshape(size, 2)))
+    except ImportError:
+        print('numpy is not installed')
+    try:
+        import pandas
+        inputs.append(('pandas frame', pandas.DataFrame({'a': range(size), 'b': range(size)})))
+    except ImportError:
+        print('pandas is not installed')
+    for name, obj in inputs:
+        for keys in (1, 2):
+            for label, function in (('chained', chained_iteration), ('bulk', iteration)):
+                report('iterate 1M rows, %s, %d keys, %s' % (name, keys, label),
+                       best_of(lambda: deque(function(obj, keys), maxlen=0), number=1, repeat=3), size, 'row')
+
+
+def bench_python_backend():
+    from jinja2 import DictLoader, Environment
+    from pypugjs.ext import html, python
+    from pypugjs.ext.jinja import PyPugJSExtension
+    src = (u'table\n'
+           u'  each row, i in rows\n'
+           u'    tr(class=row.kind)\n'
+           u'      td= i\n'
+           u'      td #{row.name}\n'
+           u'      if row.total > 10\n'
+           u'        td.big= row.total\n'
+           u'      else\n'
+           u'        td small\n')
+
+    class Row(object):
+        def __init__(self, i):
+            self.kind = 'odd' if i % 2 else 'even'
+            self.name = 'row <%d>' % i
+            self.total = i % 20
+
+    rows = [Row(i) for i in range(1000)]
+    block = Parser(src).parse()
+
+    def html_render():
+        compiler = html.Compiler(block)
+        compiler.global_context = {'rows': rows}
+        return compiler.compile()
+
+    env = Environment(loader=DictLoader({'rows.pug': src}), extensions=[PyPugJSExtension])
+    jinja_template = env.get_template('rows.pug')
+    template = python.Template(src)
+    report('render 1000 rows, html compiler', best_of(html_render, repeat=3), 1000, 'row')
+    report('render 1000 rows, jinja', best_of(lambda: jinja_template.render(rows=rows)), 1000, 'row')
+    report('render 1000 rows, python', best_of(lambda: template.render(rows=rows)), 1000, 'row')
+    report('compile to python function', best_of(lambda: python.Template(src)))
+
+
+def main(argv):
+    names = sorted(name for name in globals() if name.startswith('bench_'))
+    for name in names:
+        if not argv[1:] or any(arg in name for arg in argv[1:]):
+            globals()[name]()
+
+
+if __name__ == '__main__':
+    main(sys.argv)
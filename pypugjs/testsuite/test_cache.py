@@ -0,0 +1,250 @@
+import os
+import shutil
+import tempfile
+
+from pypugjs import nodes, utils
+from pypugjs.ext import html, python
+from pypugjs.cache import ASTCache, DiskCache, MemoryCache
+from pypugjs.compiler import Compiler
+from pypugjs.ext.jinja import Compiler as JinjaCompiler
+from pypugjs.ext.mako import Compiler as MakoCompiler
+from pypugjs.parser import Parser
+
+cases_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cases')
+
+
+class OtherParser(Parser):
+    pass
+
+
+def load(src, **options):
+    """Parse ``src``, failing unless the AST comes from the cache."""
+    parser = Parser(src, **options)
+
+    def parse_input():
+        raise AssertionError('should have been loaded from the cache')
+    parser.parse_input = parse_input
+    return parser.parse()
+
+
+class TestASTCache(object):
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = ASTCache(self.directory)
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def test_roundtrip_cases(self):
+        for filename in sorted(os.listdir(cases_dir)):
+            if not filename.endswith('.pug'):
+                continue
+            with open(os.path.join(cases_dir, filename), 'rb') as f:
+                src = f.read().decode('utf8')
+            try:
+                expected = Compiler(Parser(src).parse()).compile()
+            except Exception:
+                continue
+            Parser(src, ast_cache=self.cache).parse()
+            block = Parser(src, ast_cache=self.cache).parse()
+            assert Compiler(block).compile() == expected, filename
+
+    def test_hit_skips_parsing(self):
+        src = u'div\n  p(class="a") hello\n'
+        block = Parser(src, ast_cache=self.cache).parse()
+        cached = load(src, ast_cache=self.cache)
+        assert isinstance(cached, nodes.Block)
+        assert cached is not block
+        assert cached.nodes[0].name == 'div'
+
+    def test_key(self):
+        key = self.cache.key(Parser(u'p a'))
+        assert key == self.cache.key(Parser(u'p a', ast_cache=self.cache))
+        assert key != self.cache.key(Parser(u'p b'))
+        assert key != self.cache.key(OtherParser(u'p a'))
+        assert key != self.cache.key(Parser(u'p a', cursor=False))
+
+    def test_class_default(self):
+        Parser.ast_cache = self.cache
+        try:
+            Parser(u'p a').parse()
+            assert load(u'p a').nodes[0].name == 'p'
+        finally:
+            Parser.ast_cache = None
+
+    def test_corrupt_entry(self):
+        parser = Parser(u'p a', ast_cache=self.cache)
+        with open(self.cache.path(self.cache.key(parser)), 'wb') as f:
+            f.write(b'\x80\x04garbage')
+        assert parser.parse().nodes[0].name == 'p'
+        assert load(u'p a', ast_cache=self.cache).nodes[0].name == 'p'
+
+    def test_no_temporary_files_left(self):
+        for i in range(10):
+            Parser(u'p %d' % i, ast_cache=self.cache).parse()
+        names = os.listdir(self.directory)
+        assert len(names) == 10
+        assert all(name.endswith(ASTCache.suffix) for name in names)
+
+    def test_eviction(self):
+        Parser(u'p 0', ast_cache=self.cache).parse()
+        entry_size = sum(size for mtime, size, path in self.cache.entries())
+        cache = ASTCache(self.directory, max_size=entry_size * 3)
+        first = cache.key(Parser(u'p 0'))
+        os.utime(cache.path(first), (0, 0))
+        for i in range(1, 5):
+            Parser(u'p %d' % i, ast_cache=cache).parse()
+        assert len(cache.entries()) <= 3
+        assert sum(size for mtime, size, path in cache.entries()) <= cache.max_size
+        assert not os.path.exists(cache.path(first))
+        assert cache.stats()['evictions'] == 5 - len(cache.entries())
+
+    def test_clear(self):
+        Parser(u'p a', ast_cache=self.cache).parse()
+        self.cache.clear()
+        assert self.cache.entries() == []
+
+
+def test_memory_cache_lru():
+    cache = MemoryCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert cache.stats() == {'hits': 3, 'misses': 1, 'evictions': 1, 'size': 2}
+    cache.invalidate('a')
+    assert cache.get('a') is None
+    cache.invalidate()
+    assert cache.stats()['size'] == 0
+
+
+class TestProcessCache(object):
+    src = u'div\n  p(class=cls) hello #{name}\n'
+
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+        utils.process_cache = None
+
+    def check_backend(self, cache):
+        expected = utils.process(self.src, compiler=JinjaCompiler)
+        assert utils.process(self.src, compiler=JinjaCompiler, cache=cache) == expected
+        assert utils.process(self.src, compiler=JinjaCompiler, cache=cache) == expected
+        assert (cache.hits, cache.misses) == (1, 1)
+        # the compiler class and its options are part of the key
+        assert utils.process(self.src, compiler=MakoCompiler, cache=cache) != expected
+        assert utils.process(self.src, compiler=JinjaCompiler, cache=cache, pretty=False) == \
+            utils.process(self.src, compiler=JinjaCompiler, pretty=False)
+        assert (cache.hits, cache.misses) == (1, 3)
+
+    def test_memory_backend(self):
+        self.check_backend(MemoryCache())
+
+    def test_disk_backend(self):
+        self.check_backend(DiskCache(self.directory))
+        # a new process reads what the last one wrote
+        cache = DiskCache(self.directory)
+        utils.process(self.src, compiler=JinjaCompiler, cache=cache)
+        assert cache.hits == 1
+
+    def test_filename_is_part_of_the_key(self):
+        cache = MemoryCache()
+        utils.process(self.src, 'a.pug', compiler=JinjaCompiler, cache=cache)
+        utils.process(self.src, 'b.pug', compiler=JinjaCompiler, cache=cache)
+        utils.process(self.src, 'a.pug', compiler=JinjaCompiler, cache=cache)
+        assert (cache.hits, cache.misses) == (1, 2)
+        utils.invalidate_process(self.src, 'a.pug', compiler=JinjaCompiler, cache=cache)
+        utils.process(self.src, 'a.pug', compiler=JinjaCompiler, cache=cache)
+        assert cache.misses == 3
+
+    def test_rendering_compilers_are_not_cached(self):
+        cache = MemoryCache()
+        for name in (u'alice', u'bob', u'carol'):
+            context = html.Context({'name': name})
+            assert utils.process(u'p= name', context=context, cache=cache) == u'<p>%s</p>' % name
+        assert utils.process(u'p= name', compiler=JinjaCompiler, context=None, cache=cache) == \
+            u'<p>{{name|escape}}</p>'
+        class Compiler(html.Compiler):
+            global_context = {'name': u'dave'}
+        assert utils.process(u'p= name', compiler=Compiler, cache=cache) == u'<p>dave</p>'
+        Compiler.global_context = {'name': u'erin'}
+        assert utils.process(u'p= name', compiler=Compiler, cache=cache) == u'<p>erin</p>'
+        assert utils.process(u'p= name', compiler=python.Compiler, cache=cache) == \
+            python.Compiler(Parser(u'p= name').parse()).compile().strip()
+        assert cache.stats() == {'hits': 0, 'misses': 0, 'evictions': 0, 'size': 0}
+
+    def test_included_files_are_read_again(self):
+        with open(os.path.join(self.directory, 'item.pug'), 'wb') as f:
+            f.write(b'li one\n')
+        cache = MemoryCache()
+        src = u'ul\n  include %s\n' % os.path.join(self.directory, 'item')
+        filename = os.path.join(self.directory, 'page.pug')
+        assert utils.process(src, filename, cache=cache) == u'<ul>\n  <li>one</li>\n</ul>'
+        with open(os.path.join(self.directory, 'item.pug'), 'wb') as f:
+            f.write(b'li two\n')
+        assert utils.process(src, filename, cache=cache) == u'<ul>\n  <li>two</li>\n</ul>'
+        assert cache.stats()['size'] == 0
+        # template languages only refer to the file
+        utils.process(src, filename, compiler=JinjaCompiler, cache=cache)
+        assert cache.stats()['size'] == 1
+
+    def test_default_cache_and_invalidation(self):
+        utils.process_cache = cache = MemoryCache()
+        utils.process(self.src, compiler=JinjaCompiler)
+        utils.process(self.src, compiler=MakoCompiler)
+        utils.invalidate_process(self.src, compiler=JinjaCompiler)
+        utils.process(self.src, compiler=JinjaCompiler)
+        utils.process(self.src, compiler=MakoCompiler)
+        assert (cache.hits, cache.misses) == (1, 3)
+        utils.invalidate_process()
+        utils.process(self.src, compiler=MakoCompiler)
+        assert cache.misses == 4
+
+
+class TestHTMLCodeCache(object):
+    src = (u'- total = sum(rows)\n'
+           u'ul\n'
+           u'  each row in rows\n'
+           u'    if row > 1\n'
+           u'      li= row * 2\n'
+           u'p= total\n')
+
+    def setup(self):
+        self.cache = MemoryCache()
+
+    def render(self, src, **context):
+        compiler = html.Compiler(Parser(src).parse())
+        compiler.code_cache = self.cache
+        compiler.global_context = context
+        return compiler.compile()
+
+    def test_expressions_compile_once(self):
+        expected = u'\n<ul>\n  <li>4</li>\n  <li>6</li>\n</ul>\n<p>6</p>'
+        assert self.render(self.src, rows=[1, 2, 3]) == expected
+        # total = sum(rows), rows, row > 1, row * 2 and total
+        assert self.cache.stats()['size'] == 5
+        assert self.cache.misses == 5
+        hits = self.cache.hits
+        assert self.render(self.src, rows=[1, 2, 3]) == expected
+        assert self.cache.misses == 5
+        assert self.cache.hits == hits + 8
+
+    def test_mixin_arguments(self):
+        src = u'mixin item(name)\n  li= name\n+item("a")\n+item("a")\n'
+        assert self.render(src) == u'\n<li>a</li>\n<li>a</li>'
+        assert ('"a"'.encode('utf-8'), 'eval') in self.cache.data
+
+    def test_errors_are_not_cached(self):
+        assert self.render(u'p= 1 +\np= missing\n') == u'\n<p>None</p>\n<p>None</p>'
+        assert self.cache.stats()['size'] == 1
+
+    def test_shared_by_default(self):
+        compiler = html.Compiler(Parser(u'p= 1 + 1\n').parse())
+        assert compiler.code_cache is html.code_cache
+        compiler.compile()
+        assert (b'1 + 1', 'eval') in html.code_cache.data
@@ -1,6 +1,7 @@
 from __future__ import print_function
 import pypugjs
 import pypugjs.ext.html
+import pypugjs.ext.python
 from pypugjs.utils import process
 from pypugjs.exceptions import CurrentlyNotSupported
 import six
@@ -159,6 +160,13 @@ def html_process(src, filename):
 processors['Html'] = html_process
 
 
+def python_process(src, filename):
+    return pypugjs.ext.python.Template(src, filename='cases/%s' % filename).render()
+
+
+processors['Python'] = python_process
+
+
 def run_case(case, process):
     global processors
     processor = processors[process]
@@ -185,6 +193,7 @@ def run_case(case, process):
 
 exclusions = {
     'Html': set(['mixins', 'mixin.blocks', 'layout', 'unicode']),
+    'Python': set(['layout']),
     'Mako': set(['layout']),
     'Tornado': set(['layout']),
     'Jinja2': set(['layout']),
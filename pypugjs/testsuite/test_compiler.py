@@ -0,0 +1,282 @@
+import os
+
+from nose import SkipTest
+
+from pypugjs import nodes
+from pypugjs.compiler import Compiler, OutputBuffer
+from pypugjs.parser import Parser
+
+cases_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cases')
+
+
+def test_output_buffer_joins_once():
+    compiler = Compiler(Parser(u'div\n  p.a hello\n  p.b= value\n').parse())
+    compiled = compiler.compile()
+    assert isinstance(compiler.buf, OutputBuffer)
+    assert len(compiler.buf) > 1
+    assert compiled == u''.join(compiler.buf)
+    assert compiled == u'\n<div>\n  <p class="a">hello</p>\n  <p class="b">{{value|escape}}</p>\n</div>'
+
+
+class Widget(nodes.Node):
+    __slots__ = ('label',)
+
+    def __init__(self, label):
+        self.label = label
+
+
+class Box(nodes.Tag):
+    __slots__ = ()
+
+
+class Loud(Compiler):
+    def visit_string(self, text):
+        self.buffer(u''.join(text.nodes).upper())
+
+
+def test_visitor_subclass_override():
+    src = u'p\n  | hello\n'
+    assert Loud(Parser(src).parse()).compile() == u'\n<p>HELLO\n</p>'
+    assert Compiler(Parser(src).parse()).compile() == u'\n<p>hello\n</p>'
+    assert Loud.visitor_for(nodes.String) is not Compiler.visitor_for(nodes.String)
+
+
+def test_visitor_node_subclass():
+    box = Box('section')
+    assert Compiler(box).compile() == u'\n<section></section>'
+
+
+def test_register_visitor():
+    class WidgetCompiler(Compiler):
+        pass
+
+    block = nodes.Block(Widget(u'ok'))
+    try:
+        Compiler(block).compile()
+    except AttributeError:
+        pass
+    else:
+        assert False, 'expected no visitor for Widget'
+    WidgetCompiler.register_visitor(Widget, lambda compiler, node: compiler.buffer(u'[%s]' % node.label))
+    assert WidgetCompiler(block).compile() == u'[ok]'
+    assert Widget not in Compiler.node_visitors
+
+
+def compiler_classes():
+    from pypugjs.ext import django, html, jinja, mako, tornado, underscore
+    return [Compiler, html.Compiler, jinja.Compiler, django.Compiler, mako.Compiler, tornado.Compiler,
+            underscore.Compiler]
+
+
+def check_prerender_case(filename, compiler):
+    with open(os.path.join(cases_dir, filename), 'rb') as f:
+        src = f.read().decode('utf8')
+    try:
+        expected = compiler(Parser(src).parse(), prerender=False).compile()
+    except Exception:
+        raise SkipTest('%s does not compile with %s' % (filename, compiler.__module__))
+    block = Parser(src).parse()
+    assert compiler(block).compile() == expected
+    # a second compile reuses the renderings stored in the tree
+    assert compiler(block).compile() == expected
+
+
+def test_prerender_cases():
+    for filename in sorted(os.listdir(cases_dir)):
+        if filename.endswith('.pug') and 'include' not in filename:
+            for compiler in compiler_classes():
+                yield check_prerender_case, filename, compiler
+
+
+prerender_src = u'''html
+  body
+    nav
+      ul
+        li: a(href="/") Home
+        li: a(href="/about") About
+    p(class=cls) hello
+    each item in items
+      div.item
+        span static
+'''
+
+
+def test_prerender_collapses_static_tags():
+    block = Parser(prerender_src).parse()
+    compiler = Compiler(block)
+    compiler.compile()
+    body = block.nodes[0].block.nodes[0]
+    # the tree is left as is
+    assert [node.__class__ for node in body.block.nodes] == [nodes.Tag, nodes.Tag, nodes.Each]
+    nav, p, each = compiler.prepared[body.block]
+    assert isinstance(nav, nodes.Static) and nav.node is body.block.nodes[0]
+    assert nav.str == (u'\n    <nav>\n      <ul>\n        <li><a href="/">Home</a>\n        </li>'
+                       u'\n        <li><a href="/about">About</a>\n        </li>\n      </ul>\n    </nav>')
+    assert isinstance(p, nodes.Tag)
+    assert isinstance(compiler.prepared[each.block][0], nodes.Static)
+    assert each.block.nodes[0].__class__ is nodes.Tag
+
+
+def test_prerendered_markup_is_shared():
+    block = Parser(prerender_src).parse()
+    prepared = Compiler(block).prepare_tree()
+    first = Compiler(block, prepared=prepared).compile()
+    nav = prepared[block.nodes[0].block.nodes[0].block][0]
+    rendered = nav.str
+    assert Compiler(block, prepared=prepared).compile() == first
+    assert nav.str is rendered
+
+
+def test_prerender_keyed_by_state():
+    block = Parser(prerender_src).parse()
+    pretty = Compiler(block).compile()
+    flat = Compiler(block, pretty=False).compile()
+    assert flat == Compiler(Parser(prerender_src).parse(), pretty=False, prerender=False).compile()
+    assert pretty == Compiler(block).compile()
+    assert '<nav><ul><li><a href="/">Home</a></li>' in flat
+
+
+def test_prerender_mixin_depth():
+    from pypugjs.ext.html import Compiler as HTMLCompiler
+    src = u'mixin icon()\n  svg\n    path(d="M0")\n+icon()\ndiv\n  div\n    +icon()\n'
+    expected = HTMLCompiler(Parser(src).parse(), prerender=False).compile()
+    block = Parser(src).parse()
+    assert HTMLCompiler(block).compile() == expected
+    assert HTMLCompiler(block).compile() == expected
+    assert expected.startswith(u'\n<svg>\n  <path d="M0"></path>\n</svg>')
+    assert u'\n    <svg>\n      <path d="M0"></path>\n    </svg>' in expected
+
+
+def test_interpolation_plan():
+    from pypugjs.compiler import interpolation_plan
+    plan = interpolation_plan(Compiler.RE_INTERPOLATE, u'Hi #{name}, !{html} and \\#{x}.')
+    assert plan == (u'Hi ', ('#', u'name'), u', ', ('!', u'html'), u' and ', ('#', u'x'), u'.')
+    assert interpolation_plan(Compiler.RE_INTERPOLATE, u'#{a}') == (('#', u'a'),)
+    compiler = Compiler(None)
+    assert compiler.interpolation_plan(u'no braces') is None
+    assert compiler.interpolation_plan(u'a {b} c') is None
+
+
+def test_interpolate_plan_output():
+    compiler = Compiler(None)
+    text = u'Hi #{name}, !{html}!'
+    assert compiler.interpolate(text) == u'Hi {{name|escape}}, {{html}}!'
+    assert compiler.interpolate(text, escape=True) == u'Hi {{name|escape}}, {{html|escape}}!'
+    assert compiler.interpolate(text, escape=False) == u'Hi {{name}}, {{html}}!'
+    assert compiler._interpolate(text, lambda expression: expression.upper()) == u'Hi NAME, HTML!'
+    assert compiler.interpolate(u'plain') == u'plain'
+
+
+def test_interpolate_custom_regex():
+    import re
+
+    class Dollar(Compiler):
+        RE_INTERPOLATE = re.compile(r'(\\)?([$]){(.*?)}')
+
+    assert Dollar(None).interpolate(u'a ${b} #{c}') == u'a {{b|escape}} #{c}'
+
+
+streaming_src = u''.join(u'div.row\n  p(class=cls) line %d #{value}\n  span static %d\n' % (i, i)
+                         for i in range(300))
+
+
+def test_compile_to_chunks():
+    expected = Compiler(Parser(streaming_src).parse()).compile()
+    chunks = []
+    Compiler(Parser(streaming_src).parse()).compile_to(chunks.append, chunk_size=1000)
+    assert u''.join(chunks) == expected
+    assert len(chunks) > 10
+    assert all(1000 <= len(chunk) < 1200 for chunk in chunks[:-1])
+
+
+def test_iter_compile():
+    expected = Compiler(Parser(streaming_src).parse()).compile()
+    chunks = list(Compiler(Parser(streaming_src).parse()).iter_compile(chunk_size=1000))
+    assert u''.join(chunks) == expected
+    assert len(chunks) > 10
+
+
+def test_iter_compile_abandoned():
+    import threading
+    visited = []
+
+    class Counting(Compiler):
+        def visit_tag(self, tag):
+            visited.append(tag)
+            Compiler.visit_tag(self, tag)
+
+    threads = threading.active_count()
+    chunks = Counting(Parser(streaming_src).parse(), prerender=False).iter_compile(chunk_size=100)
+    for i in range(3):
+        next(chunks)
+    chunks.close()
+    # the worker is stopped and joined by close, partway through the tree
+    assert threading.active_count() == threads
+    assert 0 < len(visited) < 300
+    assert list(chunks) == []
+
+
+def test_iter_compile_error():
+    chunks = Compiler(nodes.Block(Widget(u'x'))).iter_compile()
+    try:
+        list(chunks)
+    except AttributeError:
+        pass
+    else:
+        assert False, 'expected the compile error'
+
+
+def test_iter_process():
+    from pypugjs.utils import iter_process, process, process_to, strip_chunks
+    src = u'\n\n' + streaming_src
+    assert u''.join(iter_process(src, chunk_size=500)) == process(src)
+    chunks = []
+    process_to(chunks.append, src, chunk_size=500)
+    assert u''.join(chunks) == process(src)
+    assert len(chunks) > 10
+    assert list(strip_chunks([u'  ', u'\n a ', u' ', u'b\n', u'  '])) == [u'a', u'  b']
+
+
+def test_convert_replaces_the_output_once_complete():
+    import shutil
+    import tempfile
+    from pypugjs.convert import write_file
+    directory = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(directory, 'page.html')
+        write_file(filename, lambda write: write(u'<p>caf\xe9</p>'))
+        with open(filename, 'rb') as f:
+            assert f.read() == u'<p>caf\xe9</p>'.encode('utf8')
+
+        def fail(write):
+            write(u'<p>partial')
+            raise ValueError()
+        try:
+            write_file(filename, fail)
+        except ValueError:
+            pass
+        else:
+            assert False
+        with open(filename, 'rb') as f:
+            assert f.read() == u'<p>caf\xe9</p>'.encode('utf8')
+        assert os.listdir(directory) == ['page.html']
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_options_stay_with_the_compiler():
+    block = Parser(u'widget\n').parse()
+    assert Compiler(block, self_closing=['widget']).compile() == u'\n<widget/>'
+    assert 'widget' not in Compiler.self_closing
+    assert Compiler(block).compile() == u'\n<widget></widget>'
+
+
+def test_constant_attributes_render_at_compile_time():
+    from pypugjs.ext import python
+    from pypugjs.ext.jinja import Compiler as JinjaCompiler
+    src = u'a(href=url, data-n=1, title="x", data-l=[1, "<"], class=["a", k])\n'
+    assert u'<a%s data-n="1" title="x" data-l="[1, &#39;&lt;&#39;]"%s></a>' in python.Template(src).source
+    # template languages read literals their own way
+    assert JinjaCompiler(Parser(src).parse()).compile() == (
+        u"<a{{__pypugjs_attrs(attrs=[('href',(url))])}} data-n=\"1\" title=\"x\""
+        u"{{__pypugjs_attrs(attrs=[('data-l',([1, \"<\"])), ('class', (([\"a\", k])))])}}></a>")
@@ -0,0 +1,194 @@
+import os
+import shutil
+import tempfile
+
+from pypugjs.ext import html
+from pypugjs.parser import Parser
+
+
+def render(src, local_context=None, **context):
+    compiler = html.Compiler(Parser(src).parse())
+    compiler.global_context = context
+    if local_context is not None:
+        compiler.local_context = local_context
+    return compiler.compile()
+
+
+class TestScope(object):
+
+    def test_lookup_falls_back_to_parent(self):
+        outer = html.Scope({'a': 1, 'b': 2}, {'c': 3})
+        inner = html.Scope({'a': 10}, outer)
+        assert (inner['a'], inner['b'], inner['c']) == (10, 2, 3)
+        assert 'c' in inner and 'd' not in inner
+        assert inner.get('d', 4) == 4
+        assert sorted(inner) == ['a', 'b', 'c']
+        assert len(inner) == 3
+
+    def test_writes_stay_in_scope(self):
+        outer = html.Scope({'a': 1})
+        inner = html.Scope({}, outer)
+        inner['a'] = 2
+        assert (inner['a'], outer['a']) == (2, 1)
+        try:
+            inner['missing']
+        except KeyError:
+            pass
+        else:
+            assert False
+
+    def test_mapping_methods_see_parent(self):
+        scope = html.Scope({'a': 1}, html.Scope({'a': 0, 'b': 2}, {'c': 3}))
+        assert sorted(scope.keys()) == ['a', 'b', 'c']
+        assert sorted(scope.values()) == [1, 2, 3]
+        assert sorted(scope.items()) == [('a', 1), ('b', 2), ('c', 3)]
+        copy = scope.copy()
+        assert copy == {'a': 1, 'b': 2, 'c': 3}
+        copy['a'] = 5
+        assert scope['a'] == 1
+
+    def test_local_context_manager_restores(self):
+        compiler = html.Compiler(Parser(u'p').parse())
+        compiler.local_context = {'x': 1}
+        with html.local_context_manager(compiler, {'y': 2}) as scope:
+            assert compiler.local_context is scope
+            assert (scope['x'], scope['y']) == (1, 2)
+        assert compiler.local_context == {'x': 1}
+
+
+def test_nested_loops_see_outer_names():
+    src = u'each row, i in rows\n  each cell in row\n    | #{prefix}#{i}#{cell}\n'
+    assert render(src, {'prefix': u'-'}, rows=[u'ab', u'c']) == u'-0a\n-0b\n-1c'
+
+
+def test_loop_assignments_do_not_leak():
+    src = (u'each x in xs\n'
+           u'  if x == 1\n'
+           u'    - y = "set"\n'
+           u'  | #{x}#{y}\n'
+           u'| #{y}\n')
+    assert render(src, xs=[1, 2], y=u'global') == u'1set\n2global\nglobal'
+
+
+def test_loop_rebinds_every_iteration():
+    src = u'each a, b in rows\n  | #{a}#{b}\n'
+    assert render(src, rows=[(1, 2), (3,)], b=u'g') == u'12\n3g'
+
+
+def test_mixin_arguments_are_scoped():
+    src = u'mixin show(name)\n  p= name\n+show("inner")\np= name\n'
+    assert render(src, name=u'outer') == u'\n<p>inner</p>\n<p>outer</p>'
+
+
+class TestTemplate(object):
+    src = (u'- greeting = "Hello " + name\n'
+           u'mixin item(value)\n'
+           u'  li(class=kind)= value\n'
+           u'h1= greeting\n'
+           u'ul.static\n'
+           u'  li first\n'
+           u'ul\n'
+           u'  each value in values\n'
+           u'    +item(value)\n')
+
+    def expected(self, name, kind, values):
+        return (u'\n<h1>Hello %s</h1>\n<ul class="static">\n  <li>first</li>\n</ul>\n<ul>%s\n</ul>' %
+                (name, u''.join(u'\n  <li class="%s">%s</li>' % (kind, value) for value in values)))
+
+    def test_render(self):
+        template = html.Template(self.src)
+        assert template.render(name=u'a', kind=u'x', values=[1, 2]) == self.expected(u'a', u'x', [1, 2])
+        assert template.render({'name': u'b', 'kind': u'y', 'values': []}) == self.expected(u'b', u'y', [])
+
+    def test_renders_leave_no_state(self):
+        template = html.Template(self.src)
+        nodes = list(template.node.nodes)
+        template.render(name=u'a', kind=u'x', values=[1])
+        assert list(template.node.nodes) == nodes
+        assert html.Compiler.global_context == {}
+        assert html.Compiler.mixins == {}
+        assert render(u'p= greeting\n') == u'\n<p>None</p>'
+        try:
+            render(u'+item(1)\n')
+        except KeyError:
+            pass
+        else:
+            assert False, 'mixin defined by another render'
+
+    def test_thread_pool(self):
+        from multiprocessing.pool import ThreadPool
+        template = html.Template(self.src)
+
+        def check(i):
+            name, kind, values = u'user%d' % i, u'kind%d' % (i % 7), list(range(i % 13))
+            return template.render(name=name, kind=kind, values=values) == self.expected(name, kind, values)
+
+        pool = ThreadPool(16)
+        try:
+            assert all(pool.map(check, range(2000), chunksize=1))
+        finally:
+            pool.close()
+            pool.join()
+
+
+class TestIncludeLoader(object):
+
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.write('item.pug', u'li= value\n')
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, src):
+        with open(os.path.join(self.directory, name), 'wb') as f:
+            f.write(src.encode('utf-8'))
+
+    def render(self, loader, **context):
+        compiler = html.Compiler(Parser(u'ul\n  each value in values\n    include item\n').parse())
+        compiler.include_loader = loader
+        compiler.global_context = context
+        return compiler.compile()
+
+    def test_parses_once(self):
+        loader = html.IncludeLoader([self.directory])
+        assert self.render(loader, values=[1, 2, 3]) == u'\n<ul>\n  <li>1</li>\n  <li>2</li>\n  <li>3</li>\n</ul>'
+        assert loader.stats() == {'hits': 2, 'misses': 1, 'reloads': 0, 'size': 1}
+
+    def test_search_path_order(self):
+        other = os.path.join(self.directory, 'other')
+        os.mkdir(other)
+        with open(os.path.join(other, 'item.pug'), 'wb') as f:
+            f.write(b'li other\n')
+        assert self.render(html.IncludeLoader([other, self.directory]), values=[1]) == \
+            u'\n<ul>\n  <li>other</li>\n</ul>'
+        try:
+            html.IncludeLoader([os.path.join(self.directory, 'missing')]).load('item')
+        except Exception as e:
+            assert "doesn't exists" in str(e)
+        else:
+            assert False
+
+    def test_reloads_changed_files(self):
+        loader = html.IncludeLoader([self.directory], check_interval=0)
+        first = loader.load('item')
+        assert loader.load('item') is first
+        self.write('item.pug', u'li(class="changed")= value\n')
+        assert self.render(loader, values=[1]) == u'\n<ul>\n  <li class="changed">1</li>\n</ul>'
+        assert loader.reloads == 1
+
+    def test_includes_next_to_the_template(self):
+        template = html.Template(u'ul\n  include item\n', filename=os.path.join(self.directory, 'page.pug'))
+        assert template.render(value=1) == u'\n<ul>\n  <li>1</li>\n</ul>'
+        self.write('item.pug', u'li(class="changed")= value\n')
+        # the shared loader notices the change on the next render
+        assert template.render(value=1) == u'\n<ul>\n  <li class="changed">1</li>\n</ul>'
+
+    def test_check_interval(self):
+        loader = html.IncludeLoader([self.directory], check_interval=None)
+        first = loader.load('item')
+        self.write('item.pug', u'li(class="changed")= value\n')
+        assert loader.load('item') is first
+        loader.invalidate('item')
+        assert loader.load('item') is not first
+
@@ -0,0 +1,205 @@
+import os
+import random
+
+import six
+
+from pypugjs.lexer import InlineLexer, Lexer, Token, detect_closing_bracket, replace_string_brackets
+from test_inline_lexer import expected_results as inline_sources
+
+cases_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cases')
+
+
+class UndispatchedLexer(Lexer):
+    """Tries every scanner for every character, like the old ``or`` chain."""
+
+    @classmethod
+    def scanners_for(cls, char, scanners=None):
+        return tuple(getattr(cls, name) for name, first in scanners or cls.scanners)
+
+
+def tokens(src, lexer=Lexer, **options):
+    lx = lexer(src, **options)
+    res = []
+    while True:
+        tok = lx.advance()
+        res.append(tok.__dict__)
+        if tok.type == 'eos':
+            break
+    return res
+
+
+def read_case(case):
+    with open(os.path.join(cases_dir, '%s.pug' % case)) as f:
+        src = f.read()
+    if isinstance(src, six.binary_type):
+        src = src.decode('utf-8')
+    return src
+
+
+def case_names():
+    return sorted(f[:-len('.pug')] for f in os.listdir(cases_dir) if f.endswith('.pug'))
+
+
+def check_cursor_matches_slicing(case):
+    src = read_case(case)
+    assert tokens(src) == tokens(src, cursor=False)
+
+
+def test_cursor_lexer():
+    for case in case_names():
+        yield check_cursor_matches_slicing, case
+
+
+def check_dispatch_matches_all_scanners(case):
+    src = read_case(case)
+    assert tokens(src) == tokens(src, lexer=UndispatchedLexer)
+
+
+def test_dispatch():
+    for case in case_names():
+        yield check_dispatch_matches_all_scanners, case
+
+
+def test_dispatch_keeps_scanner_order():
+    for lexer in (Lexer, InlineLexer):
+        names = [name for name, first in lexer.scanners]
+        for char in u'-.#(:|+! /\n\tabdefimpuyz_0\xe9':
+            expected = [getattr(lexer, name) for name in names]
+            got = list(lexer.scanners_for(char))
+            assert got == [f for f in expected if f in got]
+            assert got[-1] == lexer.text
+
+
+def check_combined_keywords(src):
+    assert tokens(src) == tokens(src, combined_keywords=True)
+
+
+def test_combined_keywords():
+    for case in case_names():
+        yield check_combined_keywords, read_case(case)
+    for src in inline_sources:
+        yield check_combined_keywords, src
+
+
+def test_iter_yields_tokens_through_eos():
+    src = read_case('inline')
+    assert [tok.__dict__ for tok in Lexer(src)] == tokens(src)
+
+
+def test_inline_tags_are_lexed_lazily():
+    lx = Lexer(u'p a #[b x] c #[i y] d')
+    assert lx.advance().val == u'p'
+    assert lx.advance().val == u'a '
+    assert len(lx.deferred_tokens) == 1 and not isinstance(lx.deferred_tokens[0], Token)
+    assert [tok.val for tok in lx][:-1] == [u'b', u' x', u' c ', u'i', u' y', u' d']
+
+
+attrs_results = [
+    (u"name='description', content=description", False,
+     [(u'name', u"'description'"), (u'content', u'description')], [u'name']),
+    (u"href= '/user/#{id}'  class  =  'button'", False,
+     [(u'href', u"'/user/'+\"{}\".format(id)+''"), (u'class', u"'button'")], []),
+    (u"href='/save',class=\"a\",static!=\"prueba\"_", False,
+     [(u'href', u"'/save'"), (u'class', u'"a"'), (u'static', u'"prueba"_')], [u'class', u'href', u'static']),
+    (u"a=f(x, (y)), b=[1, [2]]", False, [(u'a', u'f(x, (y))'), (u'b', u'[1, [2]]')], []),
+    (u"a={'k': [1, (2, 3)]}, b=\"#{x}#{y}\"", False,
+     [(u'a', u"{'k': [1, (2, 3)]}"), (u'b', u'""+"{}".format(x)+""+"{}".format(y)+""')], []),
+    (u"x=1 y=2 z=3", False, [(u'x', u'1'), (u'y', u'2 z=3')], [u'x']),
+    (u"'quoted key'=1, \"k2\"", False, [(u'quoted key', u'1'), (u'k2', True)], []),
+    (u"a:1 b:'2'", True, [(u'a', u'1'), (u'b', u"'2'")], [u'a', u'b']),
+    (u"key:value, other:'x'", False, [(u'key:value', True), (u'other:x', True)], [u'key:value']),
+]
+
+
+def check_attrs(string, colons, attrs, static_attrs):
+    lx = Lexer(u'(%s) rest' % string, colons=colons)
+    tok = lx.attrs()
+    assert list(tok.attrs.items()) == attrs
+    assert sorted(tok.static_attrs) == static_attrs
+    assert lx.input[lx.pos:] == u' rest'
+
+
+def test_attrs():
+    for string, colons, attrs, static_attrs in attrs_results:
+        yield check_attrs, string, colons, attrs, static_attrs
+
+
+inline_texts = [
+    u"Here is some #[strong: em text] and look at #[a(href='http://google.com') this link!]",
+    u"#[#[#[a a#[b #[i a] b]] d]e]",
+    u"#[strong start] line with #[i]\\#[j] inline",
+    u"Another #[strong.lil#okf(acs=[1,2]) test [[with brackets]] [in#[='side']]]",
+    u"say 'it [is]' #[b ']'] and \"#[not a tag]\" then #[i x]",
+    u"#[b x] '",
+    u"#[= '[[[[[[[[[[']",
+]
+
+
+def inline_tokens(gen):
+    try:
+        return [tok.__dict__ for tok in gen]
+    except Exception as e:
+        return str(e)
+
+
+def rescanning_inline(lexer, val):
+    """``Lexer.process_inline`` as it was, splitting the text after each
+    span anew."""
+    sval = lexer.STRING_SPLITS.split(val)
+    sval_stripped = [i.strip() for i in sval]
+
+    if sval_stripped.count('"') % 2 != 0 or sval_stripped.count("'") % 2 != 0:
+        raise Exception('Unbalanced quotes found inside inline PugJS at line %s.' % lexer.lineno)
+
+    sval_replaced = replace_string_brackets(sval)
+    start_inline = lexer.RE_INLINE.search(sval_replaced).start()
+
+    try:
+        closing = start_inline + detect_closing_bracket(sval_replaced[start_inline:])
+    except IndexError:
+        raise Exception('The end of the string was reached with no closing bracket found at line %s.' %
+                        lexer.lineno)
+
+    textl = val[:start_inline]
+    code = val[start_inline:closing][2:-1]
+    textr = val[closing:]
+
+    yield lexer.tok('string', lexer.RE_INLINE_ESCAPE.sub('#[', textl))
+
+    for tok in InlineLexer(code, inline_level=1):
+        if tok.type == 'eos':
+            break
+        yield tok
+
+    if lexer.RE_INLINE.search(textr):
+        for tok in rescanning_inline(lexer, textr):
+            yield tok
+    else:
+        yield lexer.tok('string', lexer.RE_INLINE_ESCAPE.sub('#[', textr))
+
+
+def check_single_pass_inline(text):
+    assert inline_tokens(Lexer(u'').process_inline(text)) == inline_tokens(rescanning_inline(Lexer(u''), text))
+
+
+def test_single_pass_inline():
+    for text in inline_texts:
+        yield check_single_pass_inline, text
+
+
+def test_single_pass_inline_random_texts():
+    rand = random.Random(7)
+    for i in range(5000):
+        text = u''.join(rand.choice(u'#[]"\' a') for j in range(rand.randint(1, 16)))
+        if not Lexer.RE_INLINE.search(text):
+            continue
+        expected = inline_tokens(rescanning_inline(Lexer(u''), text))
+        if 'NoneType' in expected:
+            # the old code crashed when every remaining #[ was quoted
+            continue
+        assert inline_tokens(Lexer(u'').process_inline(text)) == expected, text
+
+
+def test_inline_tags_inside_quotes_stay_text():
+    toks = list(Lexer(u'').process_inline(u"#[b x] and '#[not]'"))
+    assert [tok.val for tok in toks] == [u'', u'b', u' x', u" and '#[not]'"]
@@ -0,0 +1,195 @@
+import os
+import random
+from collections import deque
+
+from pypugjs import nodes
+from pypugjs.parser import Parser
+
+cases_dir = os.path.join(os.path.dirname(__file__), 'cases')
+
+
+def test_iter_parses_lazily():
+    src = u''.join(u'div.row\n  p item %d\n' % i for i in range(1000))
+    parser = Parser(src)
+    it = iter(parser)
+    first = next(it)
+    assert isinstance(first, nodes.Tag) and first.name == 'div'
+    assert parser.lexer.lineno < 5
+    assert len(parser.lexer.stash) <= 2
+    assert len(list(it)) == 999
+
+
+def test_parse_collects_iter():
+    src = u'p one\np two\n'
+    assert [n.name for n in Parser(src).parse().nodes] == [n.name for n in Parser(src)]
+
+
+def dump(node):
+    if isinstance(node, nodes.Node):
+        return type(node).__name__, dict((k, dump(v)) for k, v in node.attributes().items())
+    if isinstance(node, (list, deque)):
+        return [dump(item) for item in node]
+    return node
+
+
+def full_parse(src):
+    try:
+        return dump(Parser(src).parse())
+    except Exception:
+        return None
+
+
+incremental_src = u'''doctype html
+html
+  head
+    title Page
+  body
+    if user
+      p Hello #{user}
+    else
+      p Hello stranger
+    a(href='/a',
+      title='multi line') link
+    ul
+      each item in items
+        li= item
+    p.
+      some text
+      more text
+p footer
+'''
+
+incremental_edits = [
+    # (text found at the offset, removed length, inserted text)
+    (u'Page', 4, u'Home'),
+    (u'stranger', 0, u'dear '),
+    (u'p footer', 0, u'div\n  span new\n'),
+    (u'    else', 0, u'    elif guest\n      p Hi guest\n'),
+    (u"title='multi", 0, u'\n      '),
+    (u'\n    ul', 0, u'\n'),
+    (u'doctype html\n', 13, u''),
+    (u'p footer\n', 9, u'p\n  | end\n'),
+    (u'html\n', 0, u'p top\n'),
+    (u'more text', 0, u'\n\n'),
+    (u'more text', 0, u'  '),
+    (u'    p.', 0, u'p.\n  text\n'),
+    (u'    else\n', 9, u''),
+    (u'  body', 2, u''),
+]
+
+
+def check_incremental(src, edits):
+    from pypugjs.parser import IncrementalParser
+    incremental = IncrementalParser(src)
+    assert dump(incremental.block) == dump(Parser(src).parse())
+    for needle, removed, inserted in edits:
+        offset = incremental.src.index(needle)
+        block = incremental.edit(offset, removed, inserted)
+        assert block is incremental.block
+        assert dump(block) == dump(Parser(incremental.src).parse())
+
+
+def test_incremental_edit():
+    for edit in incremental_edits:
+        yield check_incremental, incremental_src, [edit]
+    yield check_incremental, incremental_src, incremental_edits
+
+
+def test_incremental_text_blocks():
+    src = u'p.\n  one\n\n  two\ndiv\n  script.\n    var a;\n  p end\n'
+    yield check_incremental, src, [(u'one', 0, u'x')]
+    yield check_incremental, src, [(u'two', 0, u'\n')]
+    yield check_incremental, src, [(u'var', 0, u'\n    ')]
+    yield check_incremental, src, [(u'p end', 0, u'p.\n  ')]
+    yield check_incremental, src, [(u'div', 0, u'.\n')]
+
+
+def test_incremental_reparses_the_block():
+    from pypugjs.parser import IncrementalParser
+    incremental = IncrementalParser(incremental_src)
+    incremental.edit(incremental.src.index(u'stranger'), 0, u'dear ')
+    start, end = incremental.reparsed
+    assert incremental.src[start:end] == u'p Hello dear stranger\n    '
+    incremental.edit(incremental.src.index(u'li='), 0, u'li first\n        ')
+    start, end = incremental.reparsed
+    assert incremental.src[start:end] == u'li first\n        li= item\n    '
+
+
+edit_texts = [u'', u'x', u' ', u'  ', u'\n', u'\n  ', u'\n\n', u'p', u'p ', u'.', u'|', u':', u'(', u')',
+              u'=', u'- ', u'#{a}', u'else', u'if a', u'elif b', u'each i in x', u'\n    ', u"'", u'div\n  ']
+
+
+def check_random_edits(src, seed, count=30):
+    from pypugjs.parser import IncrementalParser
+    rand = random.Random(seed)
+    try:
+        incremental = IncrementalParser(src)
+    except Exception:
+        return
+    for _ in range(count):
+        offset = rand.randint(0, len(incremental.src))
+        removed = rand.choice((0, 0, 1, 2, 5))
+        inserted = rand.choice(edit_texts)
+        old_src, old_dump = incremental.src, dump(incremental.block)
+        src = old_src[:offset] + inserted + old_src[offset + removed:]
+        expected = full_parse(src)
+        try:
+            incremental.edit(offset, removed, inserted)
+        except Exception:
+            assert expected is None, (old_src, offset, removed, inserted)
+            assert incremental.src == old_src
+            assert dump(incremental.block) == old_dump
+        else:
+            assert dump(incremental.block) == expected, (old_src, offset, removed, inserted)
+
+
+def test_incremental_random_edits():
+    sources = [incremental_src]
+    for name in sorted(os.listdir(cases_dir)):
+        if name.endswith('.pug'):
+            with open(os.path.join(cases_dir, name), 'rb') as f:
+                sources.append(f.read().decode('utf8'))
+    for seed, src in enumerate(sources):
+        yield check_random_edits, src, seed
+    # edits indenting the lines of the text block
+    for seed in (12, 18, 23, 28):
+        yield check_random_edits, incremental_src, seed, 40
+
+
+def test_incremental_text_block_indent():
+    from pypugjs.parser import IncrementalParser
+    offset = incremental_src.index(u'some text')
+    incremental = IncrementalParser(incremental_src)
+    src = incremental_src[:offset] + u' ' + incremental_src[offset:]
+    assert full_parse(src) is None
+    try:
+        incremental.edit(offset, 0, u' ')
+    except Exception:
+        pass
+    else:
+        assert False
+    assert incremental.src == incremental_src
+
+
+def test_incremental_shifts_lines():
+    from pypugjs.parser import IncrementalParser
+    src = u'p one\ndiv\n  p two\n'
+    incremental = IncrementalParser(src)
+    before = [node.line for node in incremental.block.nodes]
+    incremental.edit(0, 0, u'p zero\n\n')
+    assert dump(incremental.block) == dump(Parser(incremental.src).parse())
+    assert [node.line for node in incremental.block.nodes][1:] == [line + 2 for line in before]
+
+
+def test_incremental_error_keeps_source():
+    from pypugjs.parser import IncrementalParser
+    incremental = IncrementalParser(u'p one\np two\n')
+    nodes_before = list(incremental.block.nodes)
+    try:
+        incremental.edit(0, 0, u'if\n')
+    except Exception:
+        pass
+    else:
+        assert False, 'expected a parse error'
+    assert incremental.src == u'p one\np two\n'
+    assert list(incremental.block.nodes) == nodes_before
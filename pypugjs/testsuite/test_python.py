@@ -0,0 +1,143 @@
+import os
+
+import six
+
+from pypugjs.ext import python
+from pypugjs.ext.html import Compiler as HTMLCompiler
+from pypugjs.parser import Parser
+
+cases_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cases')
+
+
+def html(src, **context):
+    compiler = HTMLCompiler(Parser(src).parse())
+    compiler.global_context = context
+    return compiler.compile()
+
+
+def test_renders_context():
+    template = python.Template(u'p Hello #{name}\np= 1 + count\n')
+    assert template.render(name=u'World', count=2) == u'\n<p>Hello World</p>\n<p>3</p>'
+    assert template.render({'name': u'You', 'count': 0}) == u'\n<p>Hello You</p>\n<p>1</p>'
+
+
+def test_escapes_output():
+    template = python.Template(u'p= value\np!= value\np #{value} !{value}\n')
+    assert template.render(value=u'<b>') == (u'\n<p>&lt;b&gt;</p>\n<p><b></p>\n'
+                                             u'<p>&lt;b&gt; <b></p>')
+
+
+def test_missing_names_render_none():
+    assert python.Template(u'p= user.name\n').render() == u'\n<p>None</p>'
+
+
+def test_each_and_conditionals():
+    src = (u'ul\n'
+           u'  each item, i in items\n'
+           u'    if i == 0\n'
+           u'      li.first= item\n'
+           u'    elif i == 1\n'
+           u'      li.second= item\n'
+           u'    else\n'
+           u'      li= item\n'
+           u'  unless items\n'
+           u'    li empty\n')
+    template = python.Template(src)
+    assert template.render(items=[u'a', u'b', u'c']) == (u'\n<ul>\n  <li class="first">a</li>\n'
+                                                         u'  <li class="second">b</li>\n  <li>c</li>\n</ul>')
+    assert template.render(items=[]) == u'\n<ul>\n  <li>empty</li>\n</ul>'
+
+
+def test_matches_html_compiler():
+    src = u'div(class=cls)\n  for x in xs\n    if x\n      p= x * 2\n    else\n      p #{name}\n'
+    context = {'cls': u'box', 'xs': [0, 1, 2], 'name': u'zero'}
+    assert python.Template(src).render(context) == html(src, **context)
+
+
+def test_loop_variables_match_html_compiler():
+    cases = [
+        # loop variables don't outlive the loop
+        (u'each x in xs\n  p= x\np= x\n', {'xs': [1, 2], 'x': u'outer'}),
+        (u'each x in xs\n  each x in ys\n    p= x\n  p= x\np= x\n', {'xs': [1, 2], 'ys': [3], 'x': 0}),
+        (u'each x, i in xs\n  p #{x}#{i}\np #{x}#{i}\n', {'xs': [u'a', u'b'], 'x': u'X', 'i': u'I'}),
+        # values pair with the variables like zip pairs them
+        (u'each a, b in rows\n  p #{a}#{b}\np #{a}#{b}\n', {'rows': [(1, 2), (3,), (4, 5, 6)], 'a': u'A', 'b': u'B'}),
+        (u'each a, b in rows\n  p #{a}#{b}\n', {'rows': [(1,), (2, 3)], 'b': u'B'}),
+        # in a mixin, the loop variables are the mixin's
+        (u'mixin m(xs, y)\n  each x in xs\n    p= x\n+m([1, 2], 0)\np= x\n', {'x': u'outer'}),
+        # statements in a mixin read the template's names, and assign the mixin's
+        (u'- count = 1\nmixin inc()\n  - count = count + 1\n  p= count\n+inc()\n', {}),
+        (u'- count = 1\nmixin inc()\n  - count = count + 1\n  p= count\n+inc()\n+inc()\np= count\n', {}),
+        (u'mixin inc(count)\n  - count = count + 1\n  p= count\n+inc(5)\np= count\n', {'count': 1}),
+        (u'mixin m\n  - x = y\n  p= x\n+m\np= x\n', {'y': 1}),
+    ]
+    if not six.PY2:
+        # assignments are global, also in nested mixins
+        cases.append((u'count = 1\nmixin m\n  mixin inc\n    count = count + 1\n  +inc\n  p= count\n'
+                      u'+m\np= count\n', {}))
+    for src, context in cases:
+        assert python.Template(src).render(context) == html(src, **context), src
+
+
+def test_interpolation_escapes_unlike_html_compiler():
+    src = u'p #{value} !{value}\n'
+    assert python.Template(src).render(value=u'<b>') == u'\n<p>&lt;b&gt; <b></p>'
+    assert html(src, value=u'<b>') == u'\n<p><b> <b></p>'
+
+
+def test_text_like_interpolation_markers():
+    for text in (u'a\x000\x00b', u'\x00', u'\x00\x00'):
+        src = u'p %s #{x}\n' % text
+        assert python.Template(src).render(x=u'y') == u'\n<p>%s y</p>' % text
+
+
+def test_mixins_with_arguments():
+    src = (u'mixin link(href, title)\n'
+           u'  a(href=href)= title\n'
+           u'+link("/a", "A")\n'
+           u'+link("/b")\n')
+    assert python.Template(src).render() == u'<a href="/a">A</a><a href="/b">None</a>'
+
+
+def test_mixin_names_stay_distinct():
+    src = u'mixin a-b\n  p dash\nmixin a_b\n  p underscore\n+a-b\n+a_b\n'
+    assert python.Template(src).render() == html(src) == u'\n<p>dash</p>\n<p>underscore</p>'
+
+
+def test_dynamic_attributes():
+    src = u'a(href=url, class=classes, disabled=off)\n'
+    assert python.Template(src).render(url=u'/x', classes=[u'a', u'b'], off=False) == \
+        u'<a href="/x" class="a b"></a>'
+
+
+def test_includes_relative_to_filename():
+    filename = os.path.join(cases_dir, 'include-only-text.pug')
+    with open(filename, 'rb') as f:
+        src = f.read().decode('utf8')
+    with open(os.path.join(cases_dir, 'include-only-text.html'), 'rb') as f:
+        expected = f.read().decode('utf8')
+    assert python.Template(src, filename=filename).render().strip() == expected.strip()
+
+
+def test_render_functions_are_cached():
+    python.functions.invalidate()
+    hits = python.functions.hits
+    first = python.Template(u'p= value\n')
+    second = python.Template(u'p= value\n')
+    assert first.function is second.function
+    assert python.functions.hits == hits + 1
+    assert python.Template(u'p= other\n').function is not first.function
+
+
+def test_row_escapes_are_batched():
+    src = u'each row in rows\n  tr(class=row[0])\n    td= row[0]\n    td 100% #{row[1]}\n    td!= row[1]\n'
+    class Compiler(python.Compiler):
+        batch_escapes = True
+    template = python.Template(src, compiler=Compiler)
+    assert template.source.count(u'__pypugjs_escape_many(') == 1
+    assert template.source.count(u'__pypugjs_write(') == 1
+    rows = [(u'a', u'<b>'), (1, None)]
+    assert template.render(rows=rows) == (u'\n<tr class="a">\n  <td>a</td>\n  <td>100% &lt;b&gt;</td>'
+                                          u'\n  <td><b></td>\n</tr>'
+                                          u'\n<tr class="1">\n  <td>1</td>\n  <td>100% None</td>'
+                                          u'\n  <td>None</td>\n</tr>')
@@ -1,3 +1,9 @@
+import array
+import random
+
+import six
+from nose import SkipTest
+
 from pypugjs import runtime
 
 
@@ -31,3 +37,215 @@ class TestIteration(object):
         l = [1, 2]
         iterator = iter(l)
         assert list(runtime.iteration(iterator, 1)) == l
+
+
+class TestBulkIteration(object):
+
+    def test_lists_and_tuples_are_not_copied(self):
+        l = [(1, 2), (3, 4)]
+        assert runtime.iteration(l, 2) is l
+        assert runtime.iteration(l, 1) is l
+        assert list(runtime.iteration(l, 3)) == [(1, 2, 0), (3, 4, 1)]
+        assert list(runtime.iteration(('a', 'b'), 2)) == [('a', 0), ('b', 1)]
+        assert list(runtime.iteration((), 2)) == []
+
+    def test_arrays(self):
+        a = array.array('d', [0.5, 1.5])
+        assert list(runtime.iteration(a, 1)) == [0.5, 1.5]
+        assert list(runtime.iteration(a, 2)) == [(0.5, 0), (1.5, 1)]
+
+    def test_memoryviews(self):
+        if six.PY2:
+            raise SkipTest('python 2 memoryviews iterate over bytes')
+        view = memoryview(array.array('i', [3, 4]))
+        assert list(runtime.iteration(view, 2)) == [(3, 0), (4, 1)]
+        assert list(runtime.iteration(view.cast('B', shape=[2, 4]), 1)) == view.cast('B', shape=[2, 4]).tolist()
+        scalar = memoryview(array.array('i', [3])).cast('B').cast('i', shape=[])
+        assert runtime.bulk_rows(scalar) is None
+        try:
+            runtime.iteration(scalar, 1)
+        except TypeError:
+            pass
+        else:
+            assert False
+
+    def test_numpy_arrays(self):
+        try:
+            import numpy
+        except ImportError:
+            raise SkipTest('numpy is not installed')
+        a = numpy.arange(6).reshape(3, 2)
+        rows = list(runtime.iteration(a, 2))
+        assert all(isinstance(row, numpy.ndarray) for row in rows)
+        assert [row.tolist() for row in rows] == [[0, 1], [2, 3], [4, 5]]
+        assert list(runtime.iteration(a, 3)) == [(0, 1, 0), (2, 3, 1), (4, 5, 2)]
+        assert list(runtime.iteration(numpy.arange(3), 2)) == [(0, 0), (1, 1), (2, 2)]
+        floats = numpy.array([0.1, 0.2], dtype=numpy.float32)
+        assert [str(x) for x in runtime.iteration(floats, 1)] == [str(x) for x in floats]
+
+    def test_pandas_frames_iterate_over_rows(self):
+        try:
+            import pandas
+        except ImportError:
+            raise SkipTest('pandas is not installed')
+        frame = pandas.DataFrame({'name': ['a', 'b'], 'total': [1, 2]}, columns=['name', 'total'])
+        assert list(runtime.iteration(frame, 2)) == [('a', 1), ('b', 2)]
+        assert [row.total for row in runtime.iteration(frame, 1)] == [1, 2]
+        assert list(runtime.iteration(frame['name'], 2)) == [('a', 0), ('b', 1)]
+
+
+markup_escape = runtime.markup_escape
+
+
+class Html(object):
+    def __html__(self):
+        return u'<b>safe</b>'
+
+
+class TestEscape(object):
+
+    def teardown(self):
+        runtime.markup_escape = markup_escape
+
+    def test_it_returns_clean_text_unaltered(self):
+        s = u'nothing to see here'
+        assert runtime.escape(s) is s
+
+    def test_it_escapes_special_characters(self):
+        assert runtime.escape(u'<a href="x">Tom & Jerry\'s</a>') == \
+            u'&lt;a href=&#34;x&#34;&gt;Tom &amp; Jerry&#39;s&lt;/a&gt;'
+
+    def test_it_converts_other_values(self):
+        assert runtime.escape(b'caf\xc3\xa9 & co') == u'caf\xe9 &amp; co'
+        assert runtime.escape(42) == u'42'
+        assert runtime.escape(None) == u'None'
+        assert runtime.escape(Html()) == u'<b>safe</b>'
+
+    def test_long_text_with_and_without_markupsafe(self):
+        s = u'<p class="x">Tom & Jerry\'s</p> ' * 10
+        escaped = runtime.escape(s)
+        runtime.markup_escape = None
+        assert runtime.escape(s) == escaped
+        assert type(escaped) is type(u'')
+
+    def test_long_text_goes_through_markupsafe(self):
+        if markup_escape is None:
+            raise SkipTest('markupsafe is not installed')
+        calls = []
+
+        def recording_escape(s):
+            calls.append(s)
+            return markup_escape(s)
+
+        runtime.markup_escape = recording_escape
+        long_text = u'<p>Tom & Jerry</p> ' * 10
+        assert runtime.escape(long_text) == long_text.replace(u'&', u'&amp;').replace(u'<', u'&lt;') \
+            .replace(u'>', u'&gt;')
+        assert runtime.escape(u'<p>') == u'&lt;p&gt;'
+        assert calls == [long_text]
+
+
+class TestEscapeMany(object):
+
+    def test_it_matches_escape(self):
+        values = [u'a', u'<b>', 1, None, b'caf\xc3\xa9', Html(), u'"q"']
+        assert runtime.escape_many(values) == [runtime.escape(value) for value in values]
+
+    def test_it_returns_clean_text_unaltered(self):
+        values = [u'a', u'b c', u'']
+        escaped = runtime.escape_many(iter(values))
+        assert escaped == values
+        assert all(a is b for a, b in zip(escaped, values))
+
+
+def splicing_flatten(l, ltypes=(list, tuple)):
+    """``runtime.flatten`` as it was, splicing nested lists in place."""
+    ltype = type(l)
+    l = list(l)
+    i = 0
+    while i < len(l):
+        while isinstance(l[i], ltypes):
+            if not l[i]:
+                l.pop(i)
+                i -= 1
+                break
+            else:
+                l[i:i + 1] = l[i]
+        i += 1
+    return ltype(l)
+
+
+def random_nested(rng, depth):
+    items = []
+    for i in range(rng.randint(0, 5)):
+        kind = rng.random()
+        if depth and kind < 0.3:
+            items.append(random_nested(rng, depth - 1))
+        elif depth and kind < 0.4:
+            items.append(tuple(random_nested(rng, depth - 1)))
+        elif kind < 0.5:
+            items.append(None)
+        else:
+            items.append(u'class%d' % rng.randint(0, 9))
+    return items
+
+
+class TestFlatten(object):
+
+    def test_it_drops_empty_lists(self):
+        assert runtime.flatten([[], 'a', [[], ['b', ()]], ('c',)]) == ['a', 'b', 'c']
+        assert runtime.flatten(([[]],)) == ()
+
+    def test_it_keeps_the_input_type(self):
+        assert runtime.flatten(('a', ['b'])) == ('a', 'b')
+
+    def test_it_handles_deep_nesting(self):
+        nested = 'x'
+        for i in range(5000):
+            nested = [nested, []]
+        assert runtime.flatten(nested) == ['x']
+
+    def test_it_matches_splicing_flatten(self):
+        rng = random.Random(1234)
+        for i in range(500):
+            l = random_nested(rng, 4)
+            if i % 3 == 0:
+                l = tuple(l)
+            assert runtime.flatten(l) == splicing_flatten(l), l
+
+
+class TestAttrsCache(object):
+
+    def setup(self):
+        runtime.attrs_cache = {}
+
+    def teardown(self):
+        runtime.attrs_cache = None
+
+    def test_it_reuses_rendered_attributes(self):
+        pairs = [('class', ['btn', 'primary']), ('href', '/a?b&c')]
+        assert runtime.attrs(pairs) == u' class="btn primary" href="/a?b&amp;c"'
+        assert len(runtime.attrs_cache) == 1
+        assert runtime.attrs(list(pairs)) is runtime.attrs(pairs)
+        assert len(runtime.attrs_cache) == 1
+
+    def test_it_tells_equal_values_apart(self):
+        assert runtime.attrs([('checked', True)]) == u' checked="checked"'
+        assert runtime.attrs([('checked', 1)]) == u' checked="1"'
+        assert runtime.attrs([('class', [1])]) == u' class="1"'
+        assert runtime.attrs([('class', [True])]) == u' class="True"'
+        assert runtime.attrs([('checked', True)], terse=True) == u' checked'
+        assert runtime.attrs([('data-x', 0.0)]) == u' data-x="0.0"'
+        assert runtime.attrs([('data-x', -0.0)]) == u' data-x="-0.0"'
+        assert runtime.attrs([('class', [0.0])]) == u' class="0.0"'
+        assert runtime.attrs([('class', [-0.0])]) == u' class="-0.0"'
+
+    def test_other_values_are_not_cached(self):
+        assert runtime.attrs([('data', Html())]) == u' data="<b>safe</b>"'
+        assert runtime.attrs([('class', [['a'], 'b'])]) == u' class="a b"'
+        assert runtime.attrs_cache == {}
+
+    def test_it_is_bounded(self):
+        for i in range(runtime.MAX_ATTRS_CACHE + 10):
+            runtime.attrs([('id', i)])
+        assert len(runtime.attrs_cache) <= runtime.MAX_ATTRS_CACHE
@@ -221,12 +221,99 @@ class odict(dict):
     __iter__ = iterkeys
 
 
+from .cache import process_key
+from .compiler import DEFAULT_CHUNK_SIZE
 from .parser import Parser
 from .ext.html import Compiler as HTMLCompiler
 
+# Cache of ``process`` results used when no ``cache`` is passed to it: a
+# ``cache.MemoryCache``, a ``cache.DiskCache`` or anything with the same
+# ``get``, ``set`` and ``invalidate`` methods.
+process_cache = None
+
+
+def process(src, filename=None, parser=Parser, compiler=HTMLCompiler, cache=None, **kwargs):
+    if cache is None:
+        cache = process_cache
+    # the key covers the source and the options, not the data or files
+    # backends like the HTML one read while compiling
+    if not compiler.cacheable or 'context' in kwargs:
+        cache = None
+    if cache is not None:
+        key = process_key(src, parser, compiler, kwargs, filename)
+        output = cache.get(key)
+        if output is not None:
+            return output
+    _parser = parser(src, filename=filename)
+    block = _parser.parse()
+    _compiler = compiler(block, **kwargs)
+    output = _compiler.compile().strip()
+    if cache is not None:
+        cache.set(key, output)
+    return output
+
+
+class ChunkStripper(object):
+    """Passes the chunks given to ``write`` on to the ``write`` it wraps,
+    without the whitespace their concatenation starts and ends with."""
+
+    def __init__(self, write):
+        self.output = write
+        self.started = False
+        self.pending = u''
+
+    def write(self, chunk):
+        if not self.started:
+            chunk = chunk.lstrip()
+            if not chunk:
+                return
+            self.started = True
+        stripped = chunk.rstrip()
+        if stripped:
+            self.output(self.pending + stripped)
+            self.pending = chunk[len(stripped):]
+        else:
+            self.pending += chunk
+
+
+def strip_chunks(chunks):
+    """Yield ``chunks`` without the whitespace their concatenation starts
+    and ends with."""
+    stripped = []
+    stripper = ChunkStripper(stripped.append)
+    for chunk in chunks:
+        stripper.write(chunk)
+        for chunk in stripped:
+            yield chunk
+        del stripped[:]
+
+
+def process_to(write, src, filename=None, parser=Parser, compiler=HTMLCompiler, chunk_size=DEFAULT_CHUNK_SIZE,
+               **kwargs):
+    """Like ``process``, but pass the output to ``write`` in chunks of
+    about ``chunk_size`` characters as it is compiled. The result is not
+    cached."""
+    _parser = parser(src, filename=filename)
+    block = _parser.parse()
+    _compiler = compiler(block, **kwargs)
+    _compiler.compile_to(ChunkStripper(write).write, chunk_size)
+
 
-def process(src, filename=None, parser=Parser, compiler=HTMLCompiler, **kwargs):
+def iter_process(src, filename=None, parser=Parser, compiler=HTMLCompiler, chunk_size=DEFAULT_CHUNK_SIZE,
+                 **kwargs):
+    """Like ``process``, but yield the output in chunks of about
+    ``chunk_size`` characters as it is compiled, see
+    ``Compiler.iter_compile``. The result is not cached."""
     _parser = parser(src, filename=filename)
     block = _parser.parse()
     _compiler = compiler(block, **kwargs)
-    return _compiler.compile().strip()
+    return strip_chunks(_compiler.iter_compile(chunk_size))
+
+
+def invalidate_process(src=None, filename=None, parser=Parser, compiler=HTMLCompiler, cache=None, **kwargs):
+    """Forget the cached result of ``process`` called with these arguments,
+    or every cached result when ``src`` is None."""
+    if cache is None:
+        cache = process_cache
+    if cache is not None:
+        cache.invalidate(None if src is None else process_key(src, parser, compiler, kwargs, filename))